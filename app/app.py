@@ -1,64 +1,103 @@
-import json
 import logging
 import os
 import shutil
-from datetime import datetime
+import time
+from datetime import datetime, timedelta
 from threading import Thread
 
 import requests
-from apscheduler.schedulers.background import BackgroundScheduler
 from dotenv import load_dotenv
-from flask import Flask, jsonify, redirect, render_template, request, url_for
+from flask import (
+    Blueprint,
+    Flask,
+    Response,
+    jsonify,
+    redirect,
+    render_template,
+    request,
+    send_file,
+    send_from_directory,
+    url_for,
+)
 from flask_cors import CORS
+from werkzeug.wsgi import wrap_file
 
+import build_manager
 import cleanup_manager
 import download_manager
+import job_manager
+import metrics
 import package_manager
+import profiler
+import release_resolver
+import snapshot_manager
+import state_store
 import upload_manager
 
-load_dotenv()
-
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-app = Flask(__name__)
+bp = Blueprint("main", __name__)
+
+scheduler = None
+scheduler_lock = None
 
-CORS(app)
-scheduler = BackgroundScheduler()
+UPDATE_INTERVAL = 60
+SCHEDULER_LOCK_FILE = "config/.scheduler.lock"
+BATCH_JOB_ID = "batch-check"
 
 
-UPDATE_INTERVAL = int(os.getenv("UPDATE_INTERVAL", 60))
+def create_app():
+    global UPDATE_INTERVAL, SCHEDULER_LOCK_FILE
 
+    load_dotenv()
+    logging.basicConfig(level=logging.INFO)
 
-def load_json(filename):
-    with open(filename, "r") as file:
-        return json.load(file)
+    UPDATE_INTERVAL = int(os.getenv("UPDATE_INTERVAL", UPDATE_INTERVAL))
+    SCHEDULER_LOCK_FILE = os.getenv("SCHEDULER_LOCK_FILE", SCHEDULER_LOCK_FILE)
+    if not os.getenv("GITHUB_TOKEN"):
+        logger.warning(
+            "GITHUB_TOKEN environment variable not set. Proceeding without authentication."
+        )
 
+    # Jobs left queued or running by a worker that has since exited.
+    job_manager.reconcile_jobs()
 
-def save_json(data, filename):
-    with open(filename, "w") as file:
-        json.dump(data, file, indent=4)
+    app = Flask(__name__)
+    CORS(app)
+    app.register_blueprint(bp)
+    return app
 
 
-def load_devices():
-    return load_json("config/devices.json").get("devices", [])
+def get_devices():
+    return state_store.load_devices()
 
 
-def save_devices(devices):
-    save_json({"devices": devices}, "config/devices.json")
+def run_background_task(kind, func, *args):
+    thread = Thread(target=run_and_record, args=(kind, func) + args)
+    thread.start()
 
 
-def get_devices():
-    return load_devices()
+def run_and_record(kind, func, *args):
+    started = datetime.now()
+    start = time.perf_counter()
+    status, message = "success", ""
+    metrics.JOB_QUEUE_DEPTH.labels("running").inc()
+    try:
+        func(*args)
+    except Exception as e:
+        logger.error(f"Background {kind} run failed: {e}")
+        status, message = "error", str(e)
+    finally:
+        metrics.JOB_QUEUE_DEPTH.labels("running").dec()
+    state_store.record_run(kind, status, message, started, time.perf_counter() - start)
 
 
-def run_background_task(func, *args):
-    thread = Thread(target=func, args=args)
-    thread.start()
+def profile_requested():
+    return request.values.get("profile") == "true"
 
 
 def get_urls():
-    data = load_json("config/sources.json")
+    projects = state_store.load_sources()
     return [
         {
             "name": key,
@@ -66,42 +105,79 @@ def get_urls():
             "last_updated": project.get("last_updated", "Not available"),
             "updated": project.get("updated", False),
         }
-        for key, project in data["GitHub"].items()
-    ], data.get("last_checked", "Never")
+        for key, project in projects.items()
+    ], state_store.get_setting("last_checked", "Never")
 
 
-def get_directory_contents(path):
+def get_directory_contents(path, base_path=None):
     if not os.path.isdir(path):
         return []
+    # Paths are relative to the listed directory, which is what uploads expect.
+    base_path = base_path or path
     contents = []
     for entry in os.scandir(path):
+        relative_path = os.path.relpath(entry.path, base_path)
         if entry.is_dir():
             contents.append(
                 {
                     "type": "folder",
                     "name": f"{entry.name}/",
-                    "path": entry.path,
-                    "children": get_directory_contents(entry.path),
+                    "path": relative_path,
+                    "children": get_directory_contents(entry.path, base_path),
                 }
             )
         else:
-            contents.append({"type": "file", "name": entry.name, "path": entry.path})
+            contents.append({"type": "file", "name": entry.name, "path": relative_path})
+    return contents
+
+
+def package_folder(folders, path):
+    if path not in folders:
+        parent, _, name = path.rpartition("/")
+        children = []
+        package_folder(folders, parent).append(
+            {"type": "folder", "name": f"{name}/", "path": path, "children": children}
+        )
+        folders[path] = children
+    return folders[path]
+
+
+def get_package_contents(names):
+    contents = []
+    folders = {"": contents}
+    for name in names:
+        if name.endswith("/"):
+            package_folder(folders, name.rstrip("/"))
+        else:
+            parent, _, file_name = name.rpartition("/")
+            package_folder(folders, parent).append(
+                {"type": "file", "name": file_name, "path": name}
+            )
     return contents
 
 
 def get_tasks():
-    data = load_json("config/tasks.json")
+    return parse_tasks(state_store.load_tasks())
+
+
+def parse_tasks(task_data):
     tasks = []
-    for key, task_string in sorted(data["tasks"].items(), key=lambda x: int(x[0])):
+    for key, task_string in sorted(task_data.items(), key=lambda x: int(x[0])):
         command, path = task_string.split(maxsplit=1)
         source, destination = path.split(" ", 1) if " " in path else (path, "")
-        tasks.append({"command": command, "source": source, "destination": destination})
+        tasks.append(
+            {
+                "id": key,
+                "command": command,
+                "source": source,
+                "destination": destination,
+            }
+        )
     return tasks
 
 
 def update_urls():
     try:
-        data = load_json("config/sources.json")
         new_name = request.form.get("new_name")
         new_url = request.form.get("new_url")
 
@@ -111,6 +187,7 @@ def update_urls():
             if "api.github.com" in new_url:
                 try:
                     response = requests.get(new_url)
+                    download_manager.record_rate_limit(response)
                     response.raise_for_status()
                     releases = response.json()
 
@@ -136,8 +213,9 @@ def update_urls():
                         }
                     )
 
-            data["GitHub"][new_name] = new_entry
-            save_json(data, "config/sources.json")
+            state_store.save_source(new_name, new_entry)
+            if scheduler is not None:
+                schedule_source_jobs()
             return jsonify(
                 {"status": "success", "message": "URL updated successfully."}
             )
@@ -155,19 +233,15 @@ def update_urls():
 
 def update_tasks():
     try:
-        data = load_json("config/tasks.json")
         command = request.form.get("new_command")
         source = request.form.get("new_source")
         destination = request.form.get("new_destination", "")
         if command == "delete":
             if command and source:
-                next_index = len(data["tasks"]) + 1
-                data["tasks"][str(next_index)] = f"{command} {source}"
+                state_store.add_task(f"{command} {source}")
         else:
             if command and source and destination:
-                next_index = len(data["tasks"]) + 1
-                data["tasks"][str(next_index)] = f"{command} {source} {destination}"
-        save_json(data, "config/tasks.json")
+                state_store.add_task(f"{command} {source} {destination}")
         return jsonify({"status": "success", "message": "Task updated successfully."})
     except Exception as e:
         logger.error(f"Error updating tasks: {e}")
@@ -179,6 +253,37 @@ def update_tasks():
         )
 
 
+def get_builds():
+    builds = []
+    for profile_name, profile in state_store.load_profiles().items():
+        builds.append(
+            {
+                "name": profile_name,
+                "tasks": parse_tasks(profile.get("tasks", {})),
+                "manifest": build_manager.load_manifest(profile_name),
+            }
+        )
+    return builds
+
+
+def update_builds():
+    profile_name = request.form.get("profile_name", "").strip()
+    command = request.form.get("new_command")
+    source = request.form.get("new_source")
+    destination = request.form.get("new_destination", "")
+    if not build_manager.valid_profile_name(profile_name):
+        logger.error(f"Invalid build profile name: {profile_name}")
+        return
+
+    state_store.add_profile(profile_name)
+    if command == "delete":
+        if command and source:
+            state_store.add_task(f"{command} {source}", profile_name)
+    else:
+        if command and source and destination:
+            state_store.add_task(f"{command} {source} {destination}", profile_name)
+
+
 def clear_input_directory():
     input_dir = "downloads/input/"
     if not os.path.isdir(input_dir):
@@ -194,15 +299,13 @@ def clear_input_directory():
             print(f"Deleted directory and its contents: {item_path}")
 
 
-@app.route("/")
+@bp.route("/")
 def index():
     projects, last_checked = get_urls()
     devices = get_devices()
     next_run_time = None
 
-    job = scheduler.get_jobs()[0] if scheduler.get_jobs() else None
-    if job:
-        next_run_time = job.next_run_time
+    next_run_time = get_next_run_time(last_checked)
 
     return render_template(
         "index.html",
@@ -214,7 +317,7 @@ def index():
     )
 
 
-@app.route("/sources", methods=["GET", "POST"])
+@bp.route("/sources", methods=["GET", "POST"])
 def manage_urls():
     if request.method == "POST":
         update_urls()
@@ -229,7 +332,7 @@ def manage_urls():
     )
 
 
-@app.route("/tasks", methods=["GET", "POST"])
+@bp.route("/tasks", methods=["GET", "POST"])
 def manage_tasks():
     if request.method == "POST":
         update_tasks()
@@ -240,87 +343,111 @@ def manage_tasks():
     )
 
 
-@app.route("/delete-url", methods=["POST"])
+@bp.route("/delete-url", methods=["POST"])
 def delete_url():
     project_name = request.form.get("delete_project_name")
-    data = load_json("config/sources.json")
+    state_store.delete_source(project_name)
+    if scheduler is not None:
+        schedule_source_jobs()
+    return redirect(url_for("main.manage_urls"))
 
-    if project_name in data["GitHub"]:
-        del data["GitHub"][project_name]
 
-    save_json(data, "config/sources.json")
-    return redirect(url_for("manage_urls"))
+@bp.route("/delete-task", methods=["POST"])
+def delete_task():
+    task_id = request.form.get("delete_task_id")
+    state_store.delete_task(task_id)
+    return redirect(url_for("main.manage_tasks"))
 
 
-@app.route("/delete-task", methods=["POST"])
-def delete_task():
-    task_index = int(request.form.get("delete_task_index")) - 1
-    data = load_json("config/tasks.json")
+@bp.route("/run-downloads")
+def run_downloads():
+    run_background_task(
+        "download",
+        profiler.wrap("download", download_manager.main, profile_requested()),
+        True,
+    )
+    referer = request.headers.get("Referer")
+    return redirect(referer if referer else url_for("main.index"))
 
-    new_data = {
-        key: task
-        for i, (key, task) in enumerate(data["tasks"].items())
-        if i != task_index
-    }
 
-    new_data = {str(i + 1): task for i, task in enumerate(new_data.values())}
+def download_project(project_name, cancel_event=None):
+    project = state_store.get_source(project_name)
+    if not project:
+        return False, "Project not found"
 
-    data["tasks"] = new_data
-    save_json(data, "config/tasks.json")
-    return redirect(url_for("manage_tasks"))
+    url = project["url"]
+    try:
+        if url.endswith(".zip") or url.endswith(".7z"):
+            success = download_manager.handle_download_tasks(url, cancel_event)
+            release_timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        else:
+            success, release_timestamp = download_manager.download_from_github_api(
+                project_name, project, cancel_event
+            )
+    except Exception as e:
+        logger.error(f"Error downloading source {project_name}: {e}")
+        return False, f"Failed to download {project_name}."
 
+    if not success:
+        return False, f"Failed to download {project_name}."
 
-@app.route("/run-downloads")
-def run_downloads():
-    run_background_task(download_manager.main, True)
-    referer = request.headers.get("Referer")
-    return redirect(referer if referer else url_for("index"))
+    # Re-read the sources so edits made while the download was running are kept.
+    project = state_store.get_source(project_name)
+    if project:
+        download_manager.mark_download_complete(project, release_timestamp)
+        state_store.update_sources({project_name: project})
+    return True, f"Downloaded {project_name} successfully."
 
 
-@app.route("/download-source", methods=["POST"])
+@bp.route("/download-source", methods=["POST"])
 def download_source():
     project_name = request.form.get("project_name")
-    data = load_json("config/sources.json")
-    project = data["GitHub"].get(project_name)
 
-    if project:
-        url = project["url"]
-        try:
-            if url.endswith(".zip") or url.endswith(".7z"):
-                success = download_manager.handle_download_tasks(url)
-                release_timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            else:
-                success, release_timestamp = download_manager.download_from_github_api(
-                    project_name, project
-                )
-            if success:
-                download_manager.mark_download_complete(project, release_timestamp)
-                save_json(data, "config/sources.json")
-                return jsonify(
-                    {
-                        "status": "success",
-                        "message": f"Downloaded {project_name} successfully.",
-                    }
-                )
-            else:
-                return jsonify(
-                    {
-                        "status": "error",
-                        "message": f"Failed to download {project_name}.",
-                    }
-                )
-        except Exception as e:
-            logger.error(f"Error downloading source {project_name}: {e}")
-            return jsonify(
-                {"status": "error", "message": f"Failed to download {project_name}."}
-            )
-    else:
+    if state_store.get_source(project_name) is None:
         return jsonify({"status": "error", "message": "Project not found"})
 
+    job_id = job_manager.submit_job("download", download_project, project_name)
+    return (
+        jsonify(
+            {
+                "status": "queued",
+                "message": f"Download of {project_name} queued.",
+                "job_id": job_id,
+            }
+        ),
+        202,
+    )
 
-@app.route("/fetch-directory-contents")
+
+@bp.route("/jobs/<job_id>")
+def job_status(job_id):
+    job = job_manager.get_job(job_id)
+    if job is None:
+        return jsonify({"status": "error", "message": "Job not found"}), 404
+    return jsonify(job)
+
+
+@bp.route("/jobs/<job_id>/cancel", methods=["POST"])
+def cancel_job(job_id):
+    if job_manager.cancel_job(job_id):
+        return jsonify({"status": "success", "message": "Cancellation requested."})
+    return jsonify({"status": "error", "message": "Job not found or already finished."})
+
+
+@bp.route("/runs")
+def runs():
+    kind = request.args.get("kind")
+    limit = request.args.get("limit", 50, type=int)
+    return jsonify({"status": "success", "runs": state_store.load_runs(kind, limit)})
+
+
+@bp.route("/fetch-directory-contents")
 def fetch_directory_contents():
-    base_path = "downloads/output"
+    # Uploads read from the device's build profile, so list the same tree.
+    device = state_store.get_device(request.args.get("device"))
+    base_path = build_manager.output_directory(
+        device.get("profile") if device else None
+    )
     try:
         contents = get_directory_contents(base_path)
         return jsonify({"status": "success", "contents": contents})
@@ -331,28 +458,97 @@ def fetch_directory_contents():
         )
 
 
-@app.route("/run-cleanup")
+@bp.route("/fetch-packages")
+def fetch_packages():
+    return jsonify({"status": "success", "packages": package_manager.list_packages()})
+
+
+@bp.route("/packages")
+def packages():
+    devices = get_devices()
+    return render_template(
+        "packages.html",
+        packages=package_manager.list_packages(),
+        title="Packages",
+        current_page="packages",
+        devices=devices,
+    )
+
+
+@bp.route("/packages/<name>")
+def download_package(name):
+    package_file = package_manager.package_path(name)
+    if package_file is None:
+        return jsonify({"status": "error", "message": "Package not found"}), 404
+    metadata = package_manager.package_metadata(package_file)
+    # The content hash makes a strong ETag, so If-None-Match and If-Range keep
+    # working across rebuilds that produce an identical package.
+    response = send_file(
+        os.path.abspath(package_file),
+        as_attachment=True,
+        conditional=True,
+        etag=metadata["sha256"],
+        max_age=0,
+    )
+    return sendfile_range(response, package_file)
+
+
+def sendfile_range(response, package_file):
+    # Werkzeug copies partial content through Python. Gunicorn stops at
+    # Content-Length, so a file handle positioned at the range start lets it
+    # use sendfile for resumed downloads too.
+    if response.status_code != 206:
+        return response
+    if not request.environ.get("SERVER_SOFTWARE", "").startswith("gunicorn"):
+        return response
+    file = open(package_file, "rb")
+    file.seek(response.content_range.start)
+    range_body = response.response
+    response.response = wrap_file(request.environ, file)
+    range_body.close()
+    return response
+
+
+@bp.route("/fetch-package-contents")
+def fetch_package_contents():
+    package_file = package_manager.package_path(request.args.get("package"))
+    if package_file is None:
+        return jsonify({"status": "error", "message": "Package not found"})
+    try:
+        names = package_manager.list_package_entries(package_file)
+        return jsonify({"status": "success", "contents": get_package_contents(names)})
+    except Exception as e:
+        logger.error(f"Error reading package {package_file}: {e}")
+        return jsonify({"status": "error", "message": "Failed to read package"})
+
+
+@bp.route("/run-cleanup")
 def run_cleanup():
     print("Running cleanup tasks")
-    run_background_task(cleanup_manager.delete_files, "config/tasks.json")
+    run_background_task(
+        "cleanup",
+        profiler.wrap("cleanup", cleanup_manager.delete_files, profile_requested()),
+    )
     should_clear_input = request.args.get("clear") == "true"
     if should_clear_input:
         clear_input_directory()
     referer = request.headers.get("Referer")
-    return redirect(referer if referer else url_for("index"))
+    return redirect(referer if referer else url_for("main.index"))
 
 
-@app.route("/run-package")
+@bp.route("/run-package")
 def run_package():
-    run_background_task(package_manager.package_contents)
+    run_background_task(
+        "package",
+        profiler.wrap("package", package_manager.package_contents, profile_requested()),
+    )
     referer = request.headers.get("Referer")
-    return redirect(referer if referer else url_for("index"))
+    return redirect(referer if referer else url_for("main.index"))
 
 
-@app.route("/devices", methods=["GET", "POST"])
+@bp.route("/devices", methods=["GET", "POST"])
 def manage_devices():
     if request.method == "POST":
-        devices = load_devices()
         new_device = {
             "name": request.form.get("device_name"),
             "model": request.form.get("device_model"),
@@ -362,81 +558,408 @@ def manage_devices():
             "port": request.form.get("port"),
             "username": request.form.get("username"),
             "password": request.form.get("password"),
+            "profile": request.form.get("profile", ""),
         }
-        devices.append(new_device)
-        save_devices(devices)
-        return redirect(url_for("manage_devices"))
+        if not state_store.add_device(new_device):
+            return (
+                jsonify(
+                    {
+                        "status": "error",
+                        "message": f"A device named {new_device['name']} already exists.",
+                    }
+                ),
+                409,
+            )
+        return redirect(url_for("main.manage_devices"))
 
     devices = get_devices()
-    return render_template("devices.html", devices=devices, current_page="devices")
+    return render_template(
+        "devices.html",
+        devices=devices,
+        profiles=state_store.load_profiles(),
+        current_page="devices",
+    )
 
 
-@app.route("/edit-device", methods=["POST"])
+@bp.route("/edit-device", methods=["POST"])
 def edit_device():
     original_name = request.form.get("original_device_name")
-    devices = load_devices()
-    for device in devices:
-        if device["name"] == original_name:
-            device["name"] = request.form.get("device_name")
-            device["model"] = request.form.get("device_model")
-            device["hos_version"] = request.form.get("hos_version")
-            device["ams_version"] = request.form.get("ams_version")
-            device["ip"] = request.form.get("ip")
-            device["port"] = request.form.get("port")
-            device["username"] = request.form.get("username")
-            device["password"] = request.form.get("password")
-            break
-    save_devices(devices)
-    return redirect(url_for("manage_devices"))
-
-
-@app.route("/delete-device", methods=["POST"])
+    device = {
+        "name": request.form.get("device_name"),
+        "model": request.form.get("device_model"),
+        "hos_version": request.form.get("hos_version"),
+        "ams_version": request.form.get("ams_version"),
+        "ip": request.form.get("ip"),
+        "port": request.form.get("port"),
+        "username": request.form.get("username"),
+        "password": request.form.get("password"),
+        "profile": request.form.get("profile", ""),
+    }
+    if not state_store.update_device(original_name, device):
+        return (
+            jsonify(
+                {
+                    "status": "error",
+                    "message": f"A device named {device['name']} already exists.",
+                }
+            ),
+            409,
+        )
+    return redirect(url_for("main.manage_devices"))
+
+
+@bp.route("/delete-device", methods=["POST"])
 def delete_device():
     device_name = request.form.get("device_name")
-    devices = load_devices()
-    devices = [device for device in devices if device["name"] != device_name]
-    save_devices(devices)
-    return redirect(url_for("manage_devices"))
+    state_store.delete_device(device_name)
+    return redirect(url_for("main.manage_devices"))
+
+
+def upload_files(device, files, cancel_event=None):
+    return upload_manager.upload_to_device(
+        device["ip"],
+        device["port"],
+        device["username"],
+        device["password"],
+        build_manager.output_directory(device.get("profile")),
+        files,
+        cancel_event,
+    )
+
+
+def upload_package_files(device, package_file, files, cancel_event=None):
+    return upload_manager.upload_from_package(
+        device["ip"],
+        device["port"],
+        device["username"],
+        device["password"],
+        package_file,
+        files,
+        cancel_event,
+    )
 
 
-@app.route("/upload", methods=["POST"])
+@bp.route("/upload", methods=["POST"])
 def upload():
     device_name = request.form.get("device_name")
+    package_name = request.form.get("package")
     files = request.form.getlist("files[]")
 
     logger.info(f"Selected files: {files}")
-    if not files:
+    if package_name:
+        package_file = package_manager.package_path(package_name)
+        if package_file is None:
+            return jsonify({"status": "error", "message": "Package not found"})
+    elif not files:
         return jsonify({"status": "error", "message": "No files selected for upload."})
 
-    devices = load_json("config/devices.json").get("devices", [])
-    device = next((d for d in devices if d["name"] == device_name), None)
+    device = state_store.get_device(device_name)
     if device:
-        success, message = upload_manager.upload_to_device(
-            device["ip"],
-            device["port"],
-            device["username"],
-            device["password"],
-            "downloads/output",
-            files,
-        )
-        if success:
-            return jsonify({"status": "success", "message": message})
+        if package_name:
+            # An empty selection uploads the whole package.
+            job_id = job_manager.submit_job(
+                "upload",
+                profiler.wrap("upload", upload_package_files, profile_requested()),
+                device,
+                package_file,
+                files,
+            )
         else:
-            return jsonify({"status": "error", "message": message})
+            job_id = job_manager.submit_job(
+                "upload",
+                profiler.wrap("upload", upload_files, profile_requested()),
+                device,
+                files,
+            )
+        return (
+            jsonify(
+                {
+                    "status": "queued",
+                    "message": f"Upload to {device_name} queued.",
+                    "job_id": job_id,
+                }
+            ),
+            202,
+        )
     else:
         return jsonify({"status": "error", "message": "Device not found"})
 
 
-def scheduled_job():
+@bp.route("/builds", methods=["GET", "POST"])
+def manage_builds():
+    if request.method == "POST":
+        update_builds()
+    builds = get_builds()
+    devices = get_devices()
+    return render_template(
+        "builds.html",
+        builds=builds,
+        title="Builds",
+        current_page="builds",
+        devices=devices,
+    )
+
+
+@bp.route("/delete-build-task", methods=["POST"])
+def delete_build_task():
+    task_id = request.form.get("delete_task_id")
+    state_store.delete_task(task_id)
+    return redirect(url_for("main.manage_builds"))
+
+
+@bp.route("/delete-build", methods=["POST"])
+def delete_build():
+    profile_name = request.form.get("profile_name")
+
+    if state_store.delete_profile(profile_name):
+        build_manager.delete_build(profile_name)
+    return redirect(url_for("main.manage_builds"))
+
+
+@bp.route("/run-builds")
+def run_builds():
+    run_background_task(
+        "builds",
+        profiler.wrap("builds", build_manager.build_profiles, profile_requested()),
+    )
+    referer = request.headers.get("Referer")
+    return redirect(referer if referer else url_for("main.index"))
+
+
+@bp.route("/snapshots")
+def snapshots():
+    devices = get_devices()
+    return render_template(
+        "snapshots.html",
+        snapshots=snapshot_manager.list_snapshots(),
+        retention=snapshot_manager.retention(),
+        title="Snapshots",
+        current_page="snapshots",
+        devices=devices,
+    )
+
+
+@bp.route("/rollback", methods=["POST"])
+def rollback():
+    snapshot_name = request.form.get("snapshot_name")
+    names = [snapshot["name"] for snapshot in snapshot_manager.list_snapshots()]
+    if snapshot_name not in names:
+        return jsonify({"status": "error", "message": "Snapshot not found"})
+    try:
+        snapshot_manager.activate_snapshot(snapshot_name)
+    except OSError as e:
+        logger.error(f"Error activating snapshot {snapshot_name}: {e}")
+        return jsonify(
+            {"status": "error", "message": f"Failed to activate {snapshot_name}."}
+        )
+    return jsonify(
+        {"status": "success", "message": f"Output now points at {snapshot_name}."}
+    )
+
+
+@bp.route("/profiles")
+def profiles():
+    devices = get_devices()
+    return render_template(
+        "profiles.html",
+        profiles=profiler.list_profiles(),
+        title="Profiles",
+        current_page="profiles",
+        devices=devices,
+    )
+
+
+@bp.route("/profiles/<path:filename>")
+def download_profile(filename):
+    return send_from_directory(
+        os.path.abspath(profiler.PROFILE_DIR), filename, as_attachment=True
+    )
+
+
+@bp.route("/metrics")
+def metrics_endpoint():
+    output, content_type = metrics.render()
+    return Response(output, content_type=content_type)
+
+
+def source_job_id(project_name):
+    return f"source:{project_name}"
+
+
+def get_source_jobs():
+    if scheduler is None:
+        return []
+    return [
+        job
+        for job in scheduler.get_jobs()
+        if job.id.startswith("source:") or job.id == BATCH_JOB_ID
+    ]
+
+
+def schedule_source_jobs():
+    projects = state_store.load_sources()
+    if release_resolver.graphql_enabled():
+        # One batched query covers every due source, per-source jobs would only
+        # add REST calls on top of it.
+        wanted = {BATCH_JOB_ID: None}
+    else:
+        wanted = {source_job_id(name): name for name in projects}
+
+    for job in get_source_jobs():
+        if job.id not in wanted:
+            job.remove()
+            logger.info(f"Removed polling job {job.id}")
+
+    if BATCH_JOB_ID in wanted:
+        if not scheduler.get_job(BATCH_JOB_ID):
+            scheduler.add_job(
+                scheduled_batch_check,
+                "interval",
+                minutes=UPDATE_INTERVAL,
+                id=BATCH_JOB_ID,
+                next_run_time=datetime.now(),
+            )
+            logger.info(
+                f"Checking due sources in one batch every {UPDATE_INTERVAL} minutes"
+            )
+        return
+
+    # Spread the first check of each source evenly across the base interval so
+    # the sources are not all polled in one burst.
+    now = datetime.now()
+    total = len(projects)
+    for index, (job_id, project_name) in enumerate(wanted.items()):
+        if scheduler.get_job(job_id):
+            continue
+        interval = download_manager.poll_interval(
+            projects[project_name], UPDATE_INTERVAL
+        )
+        offset = timedelta(minutes=UPDATE_INTERVAL * (index + 1) / total)
+        scheduler.add_job(
+            scheduled_source_job,
+            "interval",
+            minutes=interval,
+            args=[project_name],
+            id=job_id,
+            next_run_time=now + offset,
+        )
+        logger.info(
+            f"Polling {project_name} every {interval} minutes, first check at {now + offset}"
+        )
+
+
+def source_is_due(project_details):
+    url = project_details["url"]
+    if url.endswith(".zip") or url.endswith(".7z"):
+        return False
+    last_checked = project_details.get("last_checked")
+    if not last_checked:
+        return True
+    interval = download_manager.poll_interval(project_details, UPDATE_INTERVAL)
+    elapsed = datetime.now() - datetime.strptime(last_checked, "%Y-%m-%d %H:%M:%S")
+    # The batch runs every UPDATE_INTERVAL, half a run of slack keeps a source
+    # from slipping to the next run because its last check ended a bit late.
+    return elapsed >= timedelta(minutes=interval - UPDATE_INTERVAL / 2)
+
+
+def scheduled_batch_check():
+    projects = state_store.load_sources()
+    due = [name for name, details in projects.items() if source_is_due(details)]
+    if not due:
+        return
+    logger.info(f"Checking {len(due)} due sources in one batch")
     try:
-        download_manager.check_and_update_sources()
+        profiler.wrap("check", download_manager.check_and_update_sources)(due)
     except Exception as e:
-        logger.error(f"Error running scheduled job: {e}")
+        logger.error(f"Error checking sources: {e}")
 
 
-if __name__ == "__main__":
-    scheduler.add_job(scheduled_job, "interval", minutes=UPDATE_INTERVAL)
+def scheduled_source_job(project_name):
+    job_id = source_job_id(project_name)
+    delay = download_manager.rate_limit_delay()
+    if delay:
+        resume_at = datetime.now() + timedelta(seconds=delay)
+        logger.warning(
+            f"GitHub rate limit reached, postponing {project_name} until {resume_at}"
+        )
+        scheduler.modify_job(job_id, next_run_time=resume_at)
+        return
+
+    try:
+        profiler.wrap("check", download_manager.check_and_update_sources)(
+            [project_name]
+        )
+    except Exception as e:
+        logger.error(f"Error checking {project_name}: {e}")
+        return
+
+    project = state_store.get_source(project_name)
+    job = scheduler.get_job(job_id)
+    if not project or not job:
+        return
+    interval = download_manager.poll_interval(project, UPDATE_INTERVAL)
+    if timedelta(minutes=interval) != job.trigger.interval:
+        scheduler.reschedule_job(job_id, trigger="interval", minutes=interval)
+        logger.info(f"Polling interval for {project_name} is now {interval} minutes")
+
+
+def get_next_run_time(last_checked):
+    run_times = [job.next_run_time for job in get_source_jobs() if job.next_run_time]
+    if run_times:
+        return min(run_times)
+    if scheduler_lock is None and last_checked not in ("Never", "Never checked"):
+        # The scheduler lives in another worker process, estimate from the last check.
+        try:
+            last = datetime.strptime(last_checked, "%Y-%m-%d %H:%M:%S")
+            return last + timedelta(minutes=UPDATE_INTERVAL)
+        except ValueError:
+            pass
+    return None
+
+
+def acquire_scheduler_lock():
+    global scheduler_lock
+    try:
+        import fcntl
+    except ImportError:
+        scheduler_lock = True
+        return True
+    os.makedirs(os.path.dirname(SCHEDULER_LOCK_FILE) or ".", exist_ok=True)
+    lock_file = open(SCHEDULER_LOCK_FILE, "w")
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        lock_file.close()
+        return False
+    lock_file.write(str(os.getpid()))
+    lock_file.flush()
+    scheduler_lock = lock_file
+    return True
+
+
+def start_scheduler():
+    global scheduler
+
+    if scheduler is not None:
+        return
+    if not acquire_scheduler_lock():
+        logger.info(f"Scheduler already running in another process (pid {os.getpid()})")
+        return
+
+    from apscheduler.schedulers.background import BackgroundScheduler
+
+    scheduler = BackgroundScheduler()
+    scheduler.add_job(
+        schedule_source_jobs, "interval", minutes=UPDATE_INTERVAL, id="sync-sources"
+    )
     scheduler.start()
-    logger.info(f"Scheduler started with interval: {UPDATE_INTERVAL} minutes")
+    schedule_source_jobs()
+    logger.info(f"Scheduler started with base interval: {UPDATE_INTERVAL} minutes")
+
+
+if __name__ == "__main__":
+    app = create_app()
+    start_scheduler()
 
-    app.run(debug=True, host="0.0.0.0", use_reloader=False)
+    debug = os.getenv("FLASK_DEBUG", "false").lower() == "true"
+    app.run(debug=debug, host="0.0.0.0", threaded=True, use_reloader=False)
@@ -0,0 +1,139 @@
+import filecmp
+import json
+import logging
+import os
+import re
+import shutil
+from datetime import datetime
+
+import cleanup_manager
+import link_manager
+import package_manager
+import profiler
+import snapshot_manager
+import state_store
+
+logger = logging.getLogger(__name__)
+
+BASE_DIRECTORY = "downloads/output"
+BUILD_DIR = "downloads/builds"
+PROFILE_NAME_PATTERN = re.compile(r"^[A-Za-z0-9_-]+$")
+
+
+def load_json(filename):
+    with open(filename, "r") as file:
+        return json.load(file)
+
+
+def save_json(data, filename):
+    with open(filename, "w") as file:
+        json.dump(data, file, indent=4)
+
+
+def valid_profile_name(name):
+    return bool(name and PROFILE_NAME_PATTERN.match(name))
+
+
+def build_directory(profile_name):
+    return os.path.join(BUILD_DIR, profile_name)
+
+
+def output_directory(profile_name):
+    if profile_name and os.path.isdir(build_directory(profile_name)):
+        return build_directory(profile_name)
+    return BASE_DIRECTORY
+
+
+def load_manifest(profile_name):
+    manifest_file = f"{build_directory(profile_name)}.json"
+    if not os.path.exists(manifest_file):
+        return None
+    return load_json(manifest_file)
+
+
+def link_file(source, destination):
+    # Hardlinks keep unchanged files on the same inode as the base output, which
+    # is what makes them free to store and cheap to tell apart from the deltas.
+    try:
+        os.link(source, destination)
+    except OSError:
+        link_manager.clone_file(source, destination)
+    return destination
+
+
+def materialize(base, destination):
+    shutil.rmtree(destination, ignore_errors=True)
+    os.makedirs(os.path.dirname(destination), exist_ok=True)
+    shutil.copytree(base, destination, symlinks=True, copy_function=link_file)
+
+
+def is_unchanged(base_path, build_path):
+    if not os.path.isfile(base_path):
+        return False
+    if os.path.samefile(base_path, build_path):
+        return True
+    if os.path.getsize(base_path) != os.path.getsize(build_path):
+        return False
+    return filecmp.cmp(base_path, build_path, shallow=False)
+
+
+def compute_delta(base, build):
+    changed = []
+    for root, dirs, files in os.walk(build):
+        for file in files:
+            build_path = os.path.join(root, file)
+            relative_path = os.path.relpath(build_path, build)
+            if not is_unchanged(os.path.join(base, relative_path), build_path):
+                changed.append(relative_path)
+
+    deleted = []
+    for root, dirs, files in os.walk(base):
+        for file in files:
+            relative_path = os.path.relpath(os.path.join(root, file), base)
+            if not os.path.lexists(os.path.join(build, relative_path)):
+                deleted.append(relative_path)
+    return sorted(changed), sorted(deleted)
+
+
+def build_profile(profile_name, tasks):
+    if not os.path.isdir(BASE_DIRECTORY):
+        logger.info(f"Cannot build {profile_name}, {BASE_DIRECTORY} does not exist.")
+        return None
+
+    destination = build_directory(profile_name)
+    logger.info(f"Building profile {profile_name} in {destination}")
+    with profiler.stage(f"materialize {profile_name}"):
+        materialize(BASE_DIRECTORY, destination)
+    cleanup_manager.run_tasks(tasks, base_path=f"{destination}/")
+    with profiler.stage(f"delta {profile_name}"):
+        changed, deleted = compute_delta(BASE_DIRECTORY, destination)
+
+    manifest = {
+        "profile": profile_name,
+        "base_snapshot": snapshot_manager.current_snapshot(),
+        "built": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        "changed": changed,
+        "deleted": deleted,
+    }
+    save_json(manifest, f"{destination}.json")
+    with profiler.stage(f"package {profile_name}"):
+        package_manager.package_profile(profile_name, destination, changed, manifest)
+    logger.info(
+        f"Built profile {profile_name}: {len(changed)} changed, {len(deleted)} deleted."
+    )
+    return manifest
+
+
+def build_profiles():
+    for profile_name, profile in state_store.load_profiles().items():
+        try:
+            build_profile(profile_name, profile.get("tasks", {}))
+        except Exception as e:
+            logger.error(f"Failed to build profile {profile_name}: {e}")
+
+
+def delete_build(profile_name):
+    shutil.rmtree(build_directory(profile_name), ignore_errors=True)
+    manifest_file = f"{build_directory(profile_name)}.json"
+    if os.path.exists(manifest_file):
+        os.remove(manifest_file)
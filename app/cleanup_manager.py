@@ -1,39 +1,40 @@
 import glob
-import json
 import logging
 import os
 import shutil
+import time
 
-logging.basicConfig(level=logging.INFO)
-logger = logging.getLogger(__name__)
-
+import link_manager
+import metrics
+import profiler
+import state_store
 
-def load_json(filename):
-    with open(filename, "r") as file:
-        return json.load(file)
+logger = logging.getLogger(__name__)
 
 
-def delete_files(file_list_filename):
-    data = load_json(file_list_filename)
-    logger.info(f"Loading tasks from: {file_list_filename}")
+def delete_files():
+    tasks = state_store.load_tasks()
+    logger.info(f"Loaded {len(tasks)} tasks from {state_store.database_path()}")
+    run_tasks(tasks)
 
-    if "tasks" not in data:
-        logger.error(f"No [tasks] section found in {file_list_filename}.")
-        return
 
-    for key, command_line in data["tasks"].items():
+def run_tasks(tasks, base_path="downloads/output/"):
+    run_start = time.perf_counter()
+    for key, command_line in tasks.items():
         try:
             command, path = command_line.split(maxsplit=1)
-            execute_command(command.strip(), path.strip())
+            with metrics.CLEANUP_TASK_SECONDS.labels(command.strip()).time():
+                with profiler.stage(f"task {key}: {command_line}"):
+                    execute_command(command.strip(), path.strip(), base_path)
         except ValueError as e:
             logger.error(f"Error processing task {key}: {str(e)}")
         except Exception as e:
             logger.error(f"Unexpected error processing task {key}: {str(e)}")
+    metrics.CLEANUP_RUN_SECONDS.observe(time.perf_counter() - run_start)
 
 
-def execute_command(command, path):
+def execute_command(command, path, base_path="downloads/output/"):
     logger.info(f"Executing command: {command}, path: {path}")
-    base_path = "downloads/output/"
     if " " in path:
         source, destination = map(str.strip, path.split(" ", 1))
         source_path = os.path.join(base_path, source)
@@ -114,13 +115,13 @@ def copy_path(source, destination):
     if not os.path.exists(os.path.dirname(destination)):
         os.makedirs(os.path.dirname(destination), exist_ok=True)
     if os.path.isdir(source):
-        shutil.copytree(source, destination)
+        link_manager.clone_tree(source, destination)
         logger.info(f"Copied directory '{source}' to '{destination}'")
     else:
-        shutil.copy(source, destination)
+        link_manager.clone_file(source, destination)
         logger.info(f"Copied file '{source}' to '{destination}'")
 
 
 if __name__ == "__main__":
-    file_list_filename = "config/tasks.json"
-    delete_files(file_list_filename)
+    logging.basicConfig(level=logging.INFO)
+    delete_files()
@@ -1,38 +1,137 @@
+import hashlib
 import json
 import logging
 import os
 import shutil
-import zipfile
+import statistics
+import time
 from datetime import datetime
+from threading import Lock
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
 
-import py7zr
 import requests
-from dotenv import load_dotenv
 
-logging.basicConfig(level=logging.INFO)
-logger = logging.getLogger(__name__)
+import link_manager
+import metrics
+import profiler
+import release_resolver
+import snapshot_manager
+import state_store
 
-load_dotenv()
+logger = logging.getLogger(__name__)
 
 dl_exceptions = ["DBI", "Ultrahand Overlay"]
 
-GITHUB_TOKEN = os.getenv("GITHUB_TOKEN")
-USE_GITHUB_TOKEN = bool(GITHUB_TOKEN)
+POLLS_PER_RELEASE = 4
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+RELEASE_HISTORY_SIZE = 10
 
-if not USE_GITHUB_TOKEN:
-    logger.warning(
-        "GITHUB_TOKEN environment variable not set. Proceeding without authentication."
-    )
+rate_limit = {"remaining": None, "reset": None}
+sources_lock = Lock()
+
+
+def github_headers():
+    token = os.getenv("GITHUB_TOKEN")
+    return {"Authorization": f"token {token}"} if token else {}
+
+
+def rate_limit_reserve():
+    return int(os.getenv("GITHUB_RATE_LIMIT_RESERVE", 5))
+
+
+def record_rate_limit(response):
+    remaining = response.headers.get("X-RateLimit-Remaining")
+    reset = response.headers.get("X-RateLimit-Reset")
+    if remaining is None or reset is None:
+        return
+    rate_limit["remaining"] = int(remaining)
+    rate_limit["reset"] = int(reset)
+    if rate_limit["remaining"] <= rate_limit_reserve():
+        reset_time = datetime.fromtimestamp(rate_limit["reset"])
+        logger.warning(
+            f"GitHub rate limit nearly exhausted ({remaining} left), resets at {reset_time}"
+        )
+
+
+def fetch_api(url, headers):
+    with metrics.HTTP_FETCH_SECONDS.labels("api").time():
+        response = requests.get(url, headers=headers)
+    metrics.HTTP_FETCH_BYTES.labels("api").inc(len(response.content))
+    record_rate_limit(response)
+    return response
+
+
+def rate_limit_delay():
+    remaining = rate_limit["remaining"]
+    if remaining is None or remaining > rate_limit_reserve():
+        return 0
+    return max(0, rate_limit["reset"] - time.time())
+
+
+def record_release(project_details, updated_at):
+    history = project_details.setdefault("release_history", [])
+    if updated_at in history:
+        return
+    history.append(updated_at)
+    history.sort()
+    del history[:-RELEASE_HISTORY_SIZE]
+
+
+def release_timestamp(project_name, release):
+    asset_index = 1 if project_name in dl_exceptions else 0
+    timestamp = None
+    if len(release.get("assets", [])) > asset_index:
+        timestamp = release["assets"][asset_index].get("updated_at")
+    timestamp = timestamp or release.get("published_at")
+    return timestamp.replace("T", " ").replace("Z", "") if timestamp else None
+
+
+def release_history_url(url):
+    parts = urlsplit(url)
+    query = dict(parse_qsl(parts.query))
+    query["per_page"] = str(RELEASE_HISTORY_SIZE)
+    return urlunsplit(parts._replace(query=urlencode(query)))
 
 
-def load_json(filename):
-    with open(filename, "r") as file:
-        return json.load(file)
+def needs_release_history(project_details):
+    url = project_details["url"]
+    if url.endswith(".zip") or url.endswith(".7z"):
+        return False
+    return not project_details.get("history_seeded")
+
+
+def seed_release_history(project_name, project_details):
+    # A poll only sees the newest release, so learning the cadence of a project
+    # that releases yearly would take years. The releases list already has the
+    # past dates, so read them once when the source is first checked.
+    url = release_history_url(project_details["url"])
+    response = fetch_api(url, github_headers())
+    response.raise_for_status()
+    releases = response.json()
+    if isinstance(releases, list):
+        for release in releases:
+            timestamp = release_timestamp(project_name, release)
+            if timestamp:
+                record_release(project_details, timestamp)
+    project_details["history_seeded"] = True
+    logger.info(
+        f"Seeded {len(project_details.get('release_history', []))} past releases for {project_name}"
+    )
 
 
-def save_json(data, filename):
-    with open(filename, "w") as file:
-        json.dump(data, file, indent=4)
+def poll_interval(project_details, base_interval):
+    history = project_details.get("release_history", [])
+    if len(history) < 2:
+        return base_interval
+    releases = [datetime.strptime(entry, "%Y-%m-%d %H:%M:%S") for entry in history]
+    gaps = [
+        (later - earlier).total_seconds() / 60
+        for earlier, later in zip(releases, releases[1:])
+    ]
+    cadence = statistics.median(gaps)
+    interval = cadence / POLLS_PER_RELEASE
+    max_interval = max(int(os.getenv("MAX_POLL_INTERVAL", 24 * 60)), base_interval)
+    return int(min(max(interval, base_interval), max_interval))
 
 
 def mark_download_complete(project_details, release_timestamp=None):
@@ -62,14 +161,17 @@ def clear_output_directory():
             logger.error(f"Failed to delete {item_path}. Reason: {e}")
 
 
-def handle_download_tasks(download_url):
+def handle_download_tasks(
+    download_url, cancel_event=None, extract_folder="downloads/output", asset=None
+):
     filename = os.path.basename(download_url)
     download_folder = "downloads/input"
     if not os.path.exists(download_folder):
         os.makedirs(download_folder)
     destination = os.path.join(download_folder, filename)
-    if download_file(download_url, destination):
-        extract_folder = "downloads/output"
+    if is_cached_download(destination, download_url, asset) or download_file(
+        download_url, destination, cancel_event, asset
+    ):
         if not os.path.exists(extract_folder):
             os.makedirs(extract_folder)
         try:
@@ -78,10 +180,9 @@ def handle_download_tasks(download_url):
             elif download_url.endswith(".7z"):
                 extract_7z(destination, extract_folder)
             else:
-                output_folder = "downloads/output"
-                if not os.path.exists(output_folder):
-                    os.makedirs(output_folder)
+                output_folder = extract_folder
                 output_destination = os.path.join(output_folder, filename)
+                link_manager.detach_existing(output_folder, [filename])
                 shutil.copyfile(destination, output_destination)
             logger.info(f"File handled successfully: {filename}")
             return True
@@ -90,45 +191,150 @@ def handle_download_tasks(download_url):
     return False
 
 
-def download_file(download_url, destination):
+def expected_sha256(asset):
+    # GitHub reports a "sha256:<hex>" digest for assets uploaded since mid-2025.
+    digest = (asset or {}).get("digest") or ""
+    return digest.split(":", 1)[1] if digest.startswith("sha256:") else None
+
+
+def is_cached_download(destination, download_url, asset):
+    record = state_store.get_asset(destination)
+    hit = False
+    if asset and record and record["url"] == download_url:
+        try:
+            stat = os.stat(destination)
+        except FileNotFoundError:
+            stat = None
+        if stat and (stat.st_size, stat.st_mtime_ns) == (
+            record["size"],
+            record["mtime_ns"],
+        ):
+            # The file is untouched since it was hashed, so the stored digest
+            # still describes it and it does not need to be read again.
+            if expected_sha256(asset):
+                hit = record["sha256"] == expected_sha256(asset)
+            else:
+                hit = (record["updated_at"], record["size"]) == (
+                    asset.get("updated_at"),
+                    asset.get("size"),
+                )
+
+    metrics.CACHE_REQUESTS.labels("asset_download", "hit" if hit else "miss").inc()
+    if hit:
+        logger.info(f"Using verified cached download: {destination}")
+    return hit
+
+
+def verify_download(destination, size, sha256, expected_size, expected_digest):
+    if expected_size is not None and size != int(expected_size):
+        logger.error(
+            f"Size mismatch for {destination}: got {size} bytes, expected {expected_size}"
+        )
+        metrics.DOWNLOAD_VERIFICATIONS.labels("size_mismatch").inc()
+        return False
+    if expected_digest and sha256 != expected_digest:
+        logger.error(
+            f"Digest mismatch for {destination}: got sha256:{sha256}, expected sha256:{expected_digest}"
+        )
+        metrics.DOWNLOAD_VERIFICATIONS.labels("digest_mismatch").inc()
+        return False
+    if expected_digest:
+        metrics.DOWNLOAD_VERIFICATIONS.labels("digest").inc()
+    elif expected_size is not None:
+        metrics.DOWNLOAD_VERIFICATIONS.labels("size").inc()
+    else:
+        metrics.DOWNLOAD_VERIFICATIONS.labels("unverified").inc()
+    return True
+
+
+def download_file(download_url, destination, cancel_event=None, asset=None):
+    partial = f"{destination}.part"
     try:
-        headers = {"Authorization": f"token {GITHUB_TOKEN}"} if USE_GITHUB_TOKEN else {}
-        response = requests.get(download_url, headers=headers, stream=True)
-        response.raise_for_status()
-        with open(destination, "wb") as f:
-            for chunk in response.iter_content(chunk_size=8192):
-                f.write(chunk)
+        headers = github_headers()
+        start = time.perf_counter()
+        sha256 = hashlib.sha256()
+        size = 0
+        with profiler.stage(f"fetch {os.path.basename(destination)}"):
+            response = requests.get(download_url, headers=headers, stream=True)
+            response.raise_for_status()
+            expected_size = (asset or {}).get("size")
+            if expected_size is None and "Content-Encoding" not in response.headers:
+                expected_size = response.headers.get("Content-Length")
+            # Hashing each chunk as it arrives avoids reading the file back.
+            with open(partial, "wb") as f:
+                for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                    if cancel_event is not None and cancel_event.is_set():
+                        break
+                    f.write(chunk)
+                    sha256.update(chunk)
+                    size += len(chunk)
+                    metrics.HTTP_FETCH_BYTES.labels("asset").inc(len(chunk))
+            response.close()
+        metrics.HTTP_FETCH_SECONDS.labels("asset").observe(time.perf_counter() - start)
+        if cancel_event is not None and cancel_event.is_set():
+            os.remove(partial)
+            logger.info(f"Download cancelled: {destination}")
+            return False
+        if not verify_download(
+            destination, size, sha256.hexdigest(), expected_size, expected_sha256(asset)
+        ):
+            os.remove(partial)
+            return False
+
+        os.replace(partial, destination)
+        state_store.save_asset(
+            destination,
+            download_url,
+            (asset or {}).get("updated_at"),
+            size,
+            os.stat(destination).st_mtime_ns,
+            sha256.hexdigest(),
+        )
         logger.info(f"File downloaded successfully: {destination}")
         return True
     except requests.exceptions.RequestException as e:
         logger.error(f"Failed to download file: {e}")
+        if os.path.exists(partial):
+            os.remove(partial)
         return False
 
 
 def extract_zip(zip_file, destination_folder):
+    import zipfile
+
     try:
-        with zipfile.ZipFile(zip_file, "r") as zip_ref:
-            zip_ref.extractall(destination_folder)
+        with metrics.EXTRACTION_SECONDS.labels("zip").time():
+            with profiler.stage(f"extract {os.path.basename(zip_file)}"):
+                with zipfile.ZipFile(zip_file, "r") as zip_ref:
+                    link_manager.detach_existing(destination_folder, zip_ref.namelist())
+                    zip_ref.extractall(destination_folder)
         logger.info(f"Zip file extracted successfully: {zip_file}")
     except Exception as e:
         logger.error(f"Failed to extract zip file {zip_file}: {e}")
 
 
 def extract_7z(archive_file, destination_folder):
+    import py7zr
+
     try:
         logger.info(f"Starting extraction of 7z file: {archive_file}")
-        with py7zr.SevenZipFile(archive_file, mode="r") as z:
-            z.extractall(path=destination_folder)
+        with metrics.EXTRACTION_SECONDS.labels("7z").time():
+            with profiler.stage(f"extract {os.path.basename(archive_file)}"):
+                with py7zr.SevenZipFile(archive_file, mode="r") as z:
+                    link_manager.detach_existing(destination_folder, z.getnames())
+                    z.extractall(path=destination_folder)
         logger.info(f"7z file extracted successfully: {archive_file}")
     except Exception as e:
         logger.error(f"Failed to extract 7z file {archive_file}: {e}")
 
 
-def download_from_github_api(project_name, project_details):
+def download_from_github_api(
+    project_name, project_details, cancel_event=None, extract_folder="downloads/output"
+):
     url = project_details["url"]
     try:
-        headers = {"Authorization": f"token {GITHUB_TOKEN}"} if USE_GITHUB_TOKEN else {}
-        response = requests.get(url, headers=headers)
+        headers = github_headers()
+        response = fetch_api(url, headers)
         response.raise_for_status()
 
         if not response.content:
@@ -148,135 +354,227 @@ def download_from_github_api(project_name, project_details):
             asset_index = 1 if project_name in dl_exceptions else 0
 
             if len(latest_release["assets"]) > asset_index:
-                download_url = latest_release["assets"][asset_index][
-                    "browser_download_url"
-                ]
-                updated_at = latest_release["assets"][asset_index].get("updated_at")
+                asset = latest_release["assets"][asset_index]
+                download_url = asset["browser_download_url"]
+                updated_at = asset.get("updated_at")
                 if updated_at:
                     updated_at = updated_at.replace("T", " ").replace("Z", "")
-                return handle_download_tasks(download_url), updated_at
+                return (
+                    handle_download_tasks(
+                        download_url, cancel_event, extract_folder, asset
+                    ),
+                    updated_at,
+                )
     except requests.RequestException as e:
         logger.error(f"Failed to process URL {url}: {e}")
     return False, None
 
 
-def check_for_updates():
-    data = load_json("config/sources.json")
-    updates_available = False
+def check_source(project_name, project_details):
+    url = project_details["url"]
 
-    for project_name, project_details in data["GitHub"].items():
-        url = project_details["url"]
-        last_updated = project_details.get("last_updated")
-        needs_download = project_details.get("updated", False)
+    headers = github_headers()
+    if project_details.get("etag"):
+        # Conditional requests answered with 304 do not count against the rate limit.
+        headers["If-None-Match"] = project_details["etag"]
+    response = fetch_api(url, headers)
+    if response.status_code == 304:
+        metrics.CACHE_REQUESTS.labels("github_etag", "hit").inc()
+        logger.info(f"No changes for {project_name} since last check.")
+        return
+    metrics.CACHE_REQUESTS.labels("github_etag", "miss").inc()
+    response.raise_for_status()
 
-        if url.endswith(".zip") or url.endswith(".7z"):
-            logger.info(f"Skipping direct file URL for {project_name}: {url}")
-            updates_available = updates_available or needs_download
-            continue
+    if not response.content:
+        logger.error(f"Empty response for project {project_name}. URL: {url}")
+        return
 
-        try:
-            headers = (
-                {"Authorization": f"token {GITHUB_TOKEN}"} if USE_GITHUB_TOKEN else {}
-            )
-            response = requests.get(url, headers=headers)
-            response.raise_for_status()
+    try:
+        releases = response.json()
+    except json.JSONDecodeError as e:
+        logger.error(f"Failed to parse JSON for {project_name}. URL: {url}, Error: {e}")
+        return
 
-            if not response.content:
-                logger.error(f"Empty response for project {project_name}. URL: {url}")
-                continue
+    if isinstance(releases, list) and releases:
+        apply_latest_release(project_name, project_details, releases[0])
 
-            try:
-                releases = response.json()
-            except json.JSONDecodeError as e:
-                logger.error(
-                    f"Failed to parse JSON for {project_name}. URL: {url}, Error: {e}"
-                )
-                continue
+    if response.headers.get("ETag"):
+        project_details["etag"] = response.headers["ETag"]
 
-            if isinstance(releases, list) and releases:
-                latest_release = releases[0]
-                asset_index = 1 if project_name in dl_exceptions else 0
 
-                if len(latest_release["assets"]) > asset_index:
-                    updated_at = latest_release["assets"][asset_index].get("updated_at")
-                    if updated_at:
-                        updated_at = updated_at.replace("T", " ").replace("Z", "")
-                        if not last_updated or updated_at > last_updated:
-                            project_details["last_updated"] = updated_at
+def apply_latest_release(project_name, project_details, latest_release):
+    last_updated = project_details.get("last_updated")
+    asset_index = 1 if project_name in dl_exceptions else 0
 
-                        needs_download = (
-                            project_details.get("downloaded_release")
-                            != project_details.get("last_updated")
-                        )
-                        project_details["updated"] = needs_download
-                        updates_available = updates_available or needs_download
+    if len(latest_release["assets"]) > asset_index:
+        updated_at = latest_release["assets"][asset_index].get("updated_at")
+        if updated_at:
+            updated_at = updated_at.replace("T", " ").replace("Z", "")
+            if not last_updated or updated_at > last_updated:
+                project_details["last_updated"] = updated_at
+            record_release(project_details, updated_at)
 
-        except requests.RequestException as e:
-            logger.error(f"Failed to check updates for {project_name}: {e}")
+            project_details["updated"] = project_details.get(
+                "downloaded_release"
+            ) != project_details.get("last_updated")
 
-        updates_available = updates_available or project_details.get("updated", False)
 
-    return updates_available, data
+def resolve_batched_releases(projects):
+    candidates = {
+        project_name: project_details
+        for project_name, project_details in projects.items()
+        if not (
+            project_details["url"].endswith(".zip")
+            or project_details["url"].endswith(".7z")
+        )
+    }
+    # A single source is cheaper as a conditional REST request, which can be a free 304.
+    if len(candidates) < 2 or not release_resolver.graphql_enabled():
+        return {}
+    return release_resolver.resolve_latest_releases(candidates)
+
+
+def check_for_updates(project_names=None):
+    updates_available = False
+
+    projects = state_store.load_sources(project_names)
+    resolved = resolve_batched_releases(projects)
+
+    for project_name, project_details in projects.items():
+        url = project_details["url"]
+
+        if needs_release_history(project_details) and not rate_limit_delay():
+            try:
+                seed_release_history(project_name, project_details)
+            except (requests.RequestException, ValueError) as e:
+                logger.error(f"Failed to read release history for {project_name}: {e}")
 
+        if url.endswith(".zip") or url.endswith(".7z"):
+            logger.info(f"Skipping direct file URL for {project_name}: {url}")
+        elif project_name in resolved:
+            latest_release = resolved[project_name]
+            if latest_release:
+                apply_latest_release(project_name, project_details, latest_release)
+            project_details["last_checked"] = datetime.now().strftime(
+                "%Y-%m-%d %H:%M:%S"
+            )
+        elif rate_limit_delay():
+            logger.warning(f"Skipping {project_name}, GitHub rate limit reached.")
+        else:
+            try:
+                check_source(project_name, project_details)
+                project_details["last_checked"] = datetime.now().strftime(
+                    "%Y-%m-%d %H:%M:%S"
+                )
+            except requests.RequestException as e:
+                logger.error(f"Failed to check updates for {project_name}: {e}")
+
+        updates_available = updates_available or project_details.get("updated", False)
 
-def perform_download_tasks(data):
-    clear_output_directory()
+    return updates_available, projects
 
-    for project_name, project_details in data["GitHub"].items():
+
+def download_projects(projects, extract_folder):
+    downloaded = 0
+    for project_name, project_details in projects.items():
         url = project_details["url"]
 
         success = False
         release_timestamp = None
         try:
             if url.endswith(".zip") or url.endswith(".7z"):
-                success = handle_download_tasks(url)
+                success = handle_download_tasks(url, extract_folder=extract_folder)
                 release_timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
             else:
                 success, release_timestamp = download_from_github_api(
-                    project_name, project_details
+                    project_name, project_details, extract_folder=extract_folder
                 )
             if success:
                 mark_download_complete(project_details, release_timestamp)
+                downloaded += 1
             else:
                 logger.error(f"Failed to process URL {url}")
         except Exception as e:
             logger.error(f"Failed to process URL {url}: {e}")
+    return downloaded
+
+
+def dedup_output(extract_folder):
+    if os.getenv("DEDUP_OUTPUT", "true").lower() == "true":
+        with profiler.stage("dedup"):
+            link_manager.dedup_directory(extract_folder)
+
+
+def perform_download_tasks(projects):
+    if not snapshot_manager.snapshots_enabled():
+        with profiler.stage("clear output"):
+            clear_output_directory()
+        download_projects(projects, "downloads/output")
+        dedup_output("downloads/output")
+        return
+
+    previous_snapshot = snapshot_manager.current_snapshot()
+    snapshot = snapshot_manager.begin_snapshot()
+    try:
+        extract_folder = snapshot_manager.snapshot_path(snapshot)
+        if not download_projects(projects, extract_folder):
+            # Keep serving the previous tree rather than switching to an empty one.
+            snapshot_manager.discard_snapshot(snapshot)
+            return
+        with profiler.stage("share unchanged"):
+            snapshot_manager.share_unchanged(snapshot, previous_snapshot)
+        dedup_output(extract_folder)
+        snapshot = snapshot_manager.finish_snapshot(snapshot)
+        snapshot_manager.activate_snapshot(snapshot)
+    except Exception:
+        # A half-built snapshot is never listed, so nothing else would remove it.
+        snapshot_manager.discard_snapshot(snapshot)
+        raise
+    snapshot_manager.prune_snapshots()
 
 
 def main(force_download=False):
     logger.info("Starting download tasks...")
-    data = load_json("config/sources.json")
+    projects = state_store.load_sources()
 
     if force_download:
         logger.info("Force download. Performing download tasks...")
-        perform_download_tasks(data)
+        perform_download_tasks(projects)
     else:
-        updates_available, data = check_for_updates()
+        with profiler.stage("check"):
+            updates_available, projects = check_for_updates()
         if updates_available:
             logger.info("Updates found. Performing download tasks...")
-            perform_download_tasks(data)
+            perform_download_tasks(projects)
         else:
             logger.info("No updates found.")
 
-    save_json(data, "config/sources.json")
+    state_store.update_sources(projects)
 
 
-def check_and_update_sources():
-    updates_available, data = check_for_updates()
-    data["last_checked"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+def check_and_update_sources(project_names=None):
+    with sources_lock:
+        updates_available, projects = check_for_updates(project_names)
 
-    if updates_available:
-        logger.info("Updates found. Updating sources.json...")
-    else:
-        logger.info("No updates found.")
-    for project_details in data["GitHub"].values():
-        if project_details.get("updated"):
-            project_details["highlight"] = True
+        if updates_available:
+            logger.info("Updates found. Updating sources...")
         else:
-            project_details.pop("highlight", None)
+            logger.info("No updates found.")
+        for project_details in projects.values():
+            if project_details.get("updated"):
+                project_details["highlight"] = True
+            else:
+                project_details.pop("highlight", None)
 
-    save_json(data, "config/sources.json")
+        state_store.update_sources(projects)
+        state_store.set_setting(
+            "last_checked", datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        )
 
 
 if __name__ == "__main__":
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    logging.basicConfig(level=logging.INFO)
     main(force_download=True)
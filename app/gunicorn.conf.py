@@ -0,0 +1,15 @@
+import os
+
+bind = f"0.0.0.0:{os.getenv('PORT', 5000)}"
+worker_class = "gthread"
+workers = int(os.getenv("WEB_WORKERS", 1))
+threads = int(os.getenv("WEB_THREADS", 8))
+timeout = int(os.getenv("WEB_TIMEOUT", 120))
+accesslog = "-"
+
+
+def post_worker_init(worker):
+    # Every worker imports the app, but only the one holding the lock runs the scheduler.
+    from app import start_scheduler
+
+    start_scheduler()
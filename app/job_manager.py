@@ -0,0 +1,182 @@
+import logging
+import os
+import time
+import uuid
+from datetime import datetime
+from threading import Event, Lock, Thread
+
+import metrics
+import state_store
+
+logger = logging.getLogger(__name__)
+
+MAX_FINISHED_JOBS = 100
+CANCEL_POLL_SECONDS = 1
+INTERRUPTED_MESSAGE = "Interrupted: the worker running this job stopped."
+
+# Job state lives in the state store so any worker process can report on a job
+# or cancel it, only the cancel flags of jobs running here are kept in memory.
+cancel_flags = {}
+cancel_flags_lock = Lock()
+process_tokens = {}
+
+
+class CancelFlag:
+    # Behaves like a threading.Event for the download and upload loops, but also
+    # notices a cancel requested through another worker process.
+
+    def __init__(self, job_id):
+        self.job_id = job_id
+        self.event = Event()
+        self.checked = time.monotonic()
+
+    def set(self):
+        self.event.set()
+
+    def is_set(self):
+        if not self.event.is_set():
+            now = time.monotonic()
+            if now - self.checked >= CANCEL_POLL_SECONDS:
+                self.checked = now
+                if state_store.job_cancel_requested(self.job_id):
+                    self.event.set()
+        return self.event.is_set()
+
+
+def now():
+    return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+
+def process_start_token(pid):
+    # The start time tells a live owner apart from a later process that was
+    # given the same pid, for example after a container restart.
+    try:
+        with open(f"/proc/{pid}/stat") as file:
+            return file.read().rsplit(")", 1)[1].split()[19]
+    except (OSError, IndexError):
+        return None
+
+
+def current_owner():
+    # Keyed by pid because forked workers inherit this module from the master.
+    pid = os.getpid()
+    if pid not in process_tokens:
+        process_tokens[pid] = process_start_token(pid) or uuid.uuid4().hex
+    return pid, process_tokens[pid]
+
+
+def owner_alive(pid, token):
+    if pid is None:
+        return False
+    if pid == os.getpid():
+        return token == current_owner()[1]
+    start_token = process_start_token(pid)
+    if start_token is not None:
+        return start_token == token
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def reconcile_job(job):
+    if job["status"] not in ("queued", "running"):
+        return job
+    if owner_alive(job["owner_pid"], job["owner_token"]):
+        return job
+    finished = now()
+    if state_store.interrupt_job(job["id"], INTERRUPTED_MESSAGE, finished):
+        logger.warning(f"Job {job['id']} ({job['kind']}) lost its worker")
+        job.update(status="error", message=INTERRUPTED_MESSAGE, finished=finished)
+        return job
+    return state_store.get_job(job["id"]) or job
+
+
+def reconcile_jobs():
+    for job in state_store.load_unfinished_jobs():
+        reconcile_job(job)
+
+
+def submit_job(kind, func, *args):
+    job_id = uuid.uuid4().hex
+    job = {"id": job_id, "kind": kind, "status": "queued", "created": now()}
+    state_store.create_job(job_id, kind, job["created"], *current_owner())
+    state_store.prune_finished_jobs(MAX_FINISHED_JOBS)
+    cancel_flag = CancelFlag(job_id)
+    with cancel_flags_lock:
+        cancel_flags[job_id] = cancel_flag
+    metrics.JOB_QUEUE_DEPTH.labels("queued").inc()
+
+    thread = Thread(target=run_job, args=(job, cancel_flag, func) + args, daemon=True)
+    thread.start()
+    logger.info(f"Queued {kind} job {job_id}")
+    return job_id
+
+
+def run_job(job, cancel_flag, func, *args):
+    metrics.JOB_QUEUE_DEPTH.labels("queued").dec()
+    if cancel_flag.is_set() or state_store.job_cancel_requested(job["id"]):
+        finish_job(job, "cancelled", "Cancelled before it started.")
+        return
+
+    metrics.JOB_QUEUE_DEPTH.labels("running").inc()
+    job["status"] = "running"
+    job["started"] = now()
+    state_store.update_job(job["id"], status="running", started=job["started"])
+    try:
+        success, message = func(*args, cancel_event=cancel_flag)
+        if cancel_flag.is_set():
+            finish_job(job, "cancelled", message or "Cancelled.")
+        else:
+            finish_job(job, "success" if success else "error", message)
+    except Exception as e:
+        logger.error(f"Job {job['id']} failed: {e}")
+        finish_job(job, "error", f"Unexpected error: {str(e)}")
+
+
+def finish_job(job, status, message):
+    if job["status"] == "running":
+        metrics.JOB_QUEUE_DEPTH.labels("running").dec()
+    job["status"] = status
+    finished = now()
+    state_store.update_job(
+        job["id"], status=status, message=message or "", finished=finished
+    )
+    with cancel_flags_lock:
+        cancel_flags.pop(job["id"], None)
+    logger.info(f"Job {job['id']} ({job['kind']}) finished with status {status}")
+
+    started = datetime.strptime(
+        job.get("started") or job["created"], "%Y-%m-%d %H:%M:%S"
+    )
+    duration = (
+        datetime.strptime(finished, "%Y-%m-%d %H:%M:%S") - started
+    ).total_seconds()
+    state_store.record_run(job["kind"], status, message, started, duration)
+
+
+def get_job(job_id):
+    job = state_store.get_job(job_id)
+    if job is None:
+        return None
+    job = reconcile_job(job)
+    for field in ("cancel_requested", "owner_pid", "owner_token"):
+        job.pop(field)
+    return job
+
+
+def cancel_job(job_id):
+    job = state_store.get_job(job_id)
+    if job is None or reconcile_job(job)["status"] not in ("queued", "running"):
+        return False
+    if not state_store.request_job_cancel(job_id):
+        return False
+    with cancel_flags_lock:
+        cancel_flag = cancel_flags.get(job_id)
+    if cancel_flag is not None:
+        cancel_flag.set()
+    logger.info(f"Cancellation requested for job {job_id}")
+    return True
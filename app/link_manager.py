@@ -0,0 +1,138 @@
+import hashlib
+import logging
+import os
+import shutil
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# ioctl request number for FICLONE on Linux (btrfs, XFS with reflink, overlayfs on those).
+FICLONE = 0x40049409
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def copy_mode():
+    # auto tries a reflink, then a hardlink, then a regular copy.
+    return os.getenv("COPY_MODE", "auto").lower()
+
+
+def try_reflink(source, destination):
+    try:
+        import fcntl
+    except ImportError:
+        return False
+    try:
+        with open(source, "rb") as src, open(destination, "wb") as dst:
+            fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+    except OSError:
+        if os.path.exists(destination):
+            os.remove(destination)
+        return False
+    shutil.copymode(source, destination)
+    return True
+
+
+def try_hardlink(source, destination):
+    try:
+        os.link(source, destination)
+    except OSError:
+        return False
+    return True
+
+
+def clone_file(source, destination):
+    if os.path.isdir(destination):
+        destination = os.path.join(destination, os.path.basename(source))
+    mode = copy_mode()
+    if mode in ("auto", "reflink") and try_reflink(source, destination):
+        method = "reflink"
+    elif mode in ("auto", "hardlink") and try_hardlink(source, destination):
+        method = "hardlink"
+    else:
+        shutil.copy(source, destination)
+        method = "copy"
+    metrics.COPY_FILES.labels(method).inc()
+    return destination
+
+
+def clone_tree(source, destination):
+    return shutil.copytree(source, destination, copy_function=clone_file)
+
+
+def detach_existing(destination_folder, names):
+    # Files shared through hardlinks must not be rewritten in place, or every
+    # linked copy would change too. Unlink them so extraction writes new files.
+    for name in names:
+        path = os.path.join(destination_folder, name)
+        try:
+            if os.path.isfile(path) and os.stat(path).st_nlink > 1:
+                os.remove(path)
+        except OSError as e:
+            logger.error(f"Failed to detach {path}: {e}")
+
+
+def file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def replace_with_link(original, duplicate):
+    temporary = f"{duplicate}.switchblend-link"
+    if os.path.exists(temporary):
+        os.remove(temporary)
+    mode = copy_mode()
+    if mode in ("auto", "reflink") and try_reflink(original, temporary):
+        method = "reflink"
+    elif mode in ("auto", "hardlink") and try_hardlink(original, temporary):
+        method = "hardlink"
+    else:
+        return None
+    os.replace(temporary, duplicate)
+    return method
+
+
+def dedup_directory(root):
+    if copy_mode() == "copy" or not os.path.isdir(root):
+        return 0, 0
+
+    by_size = {}
+    for current, dirs, files in os.walk(root):
+        for file in files:
+            path = os.path.join(current, file)
+            if os.path.islink(path):
+                continue
+            size = os.path.getsize(path)
+            if size:
+                by_size.setdefault(size, []).append(path)
+
+    collapsed = 0
+    saved = 0
+    for size, paths in by_size.items():
+        if len(paths) < 2:
+            continue
+        by_digest = {}
+        for path in paths:
+            by_digest.setdefault(file_digest(path), []).append(path)
+        for duplicates in by_digest.values():
+            original = duplicates[0]
+            original_inode = os.stat(original).st_ino
+            for duplicate in duplicates[1:]:
+                if os.stat(duplicate).st_ino == original_inode:
+                    continue
+                try:
+                    method = replace_with_link(original, duplicate)
+                except OSError as e:
+                    logger.error(f"Failed to deduplicate {duplicate}: {e}")
+                    continue
+                if method:
+                    collapsed += 1
+                    saved += size
+                    metrics.COPY_FILES.labels(method).inc()
+
+    metrics.DEDUP_BYTES.inc(saved)
+    logger.info(f"Deduplicated {collapsed} files in {root}, saving {saved} bytes.")
+    return collapsed, saved
@@ -0,0 +1,90 @@
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+)
+
+TRANSFER_BUCKETS = (0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+HTTP_FETCH_SECONDS = Histogram(
+    "switchblend_http_fetch_seconds",
+    "Time spent fetching from GitHub and asset hosts.",
+    ["kind"],
+    buckets=TRANSFER_BUCKETS,
+)
+HTTP_FETCH_BYTES = Counter(
+    "switchblend_http_fetch_bytes_total",
+    "Bytes received from GitHub and asset hosts.",
+    ["kind"],
+)
+DOWNLOAD_VERIFICATIONS = Counter(
+    "switchblend_download_verifications_total",
+    "Downloaded assets checked against their expected size and digest, by result.",
+    ["result"],
+)
+CACHE_REQUESTS = Counter(
+    "switchblend_cache_requests_total",
+    "Cache lookups by cache and result (hit or miss).",
+    ["cache", "result"],
+)
+EXTRACTION_SECONDS = Histogram(
+    "switchblend_extraction_seconds",
+    "Time spent extracting a downloaded archive.",
+    ["format"],
+    buckets=TRANSFER_BUCKETS,
+)
+PACKAGE_SECONDS = Histogram(
+    "switchblend_package_seconds",
+    "Time spent packaging the output directory.",
+    buckets=TRANSFER_BUCKETS,
+)
+PACKAGE_BYTES = Counter(
+    "switchblend_package_bytes_total",
+    "Uncompressed and compressed bytes written to packages.",
+    ["size"],
+)
+PACKAGE_COMPRESSION_RATIO = Gauge(
+    "switchblend_package_compression_ratio",
+    "Compressed size divided by uncompressed size of the last package.",
+)
+FTP_BYTES = Counter(
+    "switchblend_ftp_bytes_total", "Bytes uploaded to devices over FTP."
+)
+FTP_FILES = Counter(
+    "switchblend_ftp_files_total", "Files uploaded to devices over FTP."
+)
+FTP_UPLOAD_SECONDS = Histogram(
+    "switchblend_ftp_upload_seconds",
+    "Duration of an upload to a device.",
+    buckets=TRANSFER_BUCKETS,
+)
+CLEANUP_TASK_SECONDS = Histogram(
+    "switchblend_cleanup_task_seconds",
+    "Duration of a single cleanup task.",
+    ["command"],
+)
+CLEANUP_RUN_SECONDS = Histogram(
+    "switchblend_cleanup_run_seconds",
+    "Duration of a full cleanup run.",
+    buckets=TRANSFER_BUCKETS,
+)
+COPY_FILES = Counter(
+    "switchblend_copy_files_total",
+    "Files copied or deduplicated, by method (reflink, hardlink or copy).",
+    ["method"],
+)
+DEDUP_BYTES = Counter(
+    "switchblend_dedup_bytes_total",
+    "Bytes reclaimed by collapsing identical files in the output directory.",
+)
+JOB_QUEUE_DEPTH = Gauge(
+    "switchblend_jobs",
+    "Background jobs currently waiting or running.",
+    ["status"],
+)
+
+
+def render():
+    return generate_latest(), CONTENT_TYPE_LATEST
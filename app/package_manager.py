@@ -1,16 +1,25 @@
+import fnmatch
+import json
 import logging
 import os
-import zipfile
+import time
 from datetime import datetime
 
-logging.basicConfig(level=logging.INFO)
+import link_manager
+import metrics
+import snapshot_manager
+
 logger = logging.getLogger(__name__)
 
+MANIFEST_NAME = "switchblend-profile.json"
+PACKAGE_DIR = "downloads"
+PACKAGE_PATTERN = "AIO-*.zip"
+
 
 def package_contents():
     directory_to_zip = "downloads/output/"
     timestamp = datetime.now().strftime("%Y%m%d")
-    output_zip_file = f"downloads/AIO-{timestamp}.zip"
+    output_zip_file = os.path.join(PACKAGE_DIR, f"AIO-{timestamp}.zip")
 
     if not os.path.isdir(directory_to_zip):
         logger.info(f"No files to package because {directory_to_zip} does not exist.")
@@ -20,27 +29,177 @@ def package_contents():
         logger.info(f"No files to package in {directory_to_zip}.")
         return
 
-    os.makedirs("downloads/", exist_ok=True)
+    os.makedirs(PACKAGE_DIR, exist_ok=True)
+    write_package(
+        directory_to_zip,
+        output_zip_file,
+        metadata={"profile": None, "snapshot": snapshot_manager.current_snapshot()},
+    )
+
+
+def package_profile(profile_name, build_directory, changed_paths, manifest):
+    timestamp = datetime.now().strftime("%Y%m%d")
+    output_zip_file = os.path.join(PACKAGE_DIR, f"AIO-{profile_name}-{timestamp}.zip")
+    write_package(
+        build_directory,
+        output_zip_file,
+        relative_paths=changed_paths,
+        manifest=manifest,
+        metadata={
+            "profile": profile_name,
+            "snapshot": manifest.get("base_snapshot"),
+            "changed": len(manifest.get("changed", [])),
+            "deleted": len(manifest.get("deleted", [])),
+        },
+    )
+    return output_zip_file
+
+
+def list_package_paths(directory_to_zip):
+    paths = []
+    for root, dirs, files in os.walk(directory_to_zip):
+        for file in files:
+            paths.append(os.path.relpath(os.path.join(root, file), directory_to_zip))
 
-    with zipfile.ZipFile(output_zip_file, "w", zipfile.ZIP_DEFLATED) as zipf:
-        for root, dirs, files in os.walk(directory_to_zip):
-            for file in files:
-                full_path = os.path.join(root, file)
-                relative_path = os.path.relpath(full_path, directory_to_zip)
-                zipf.write(full_path, arcname=relative_path)
+        for dir in dirs:
+            empty_dir_path = os.path.join(root, dir)
+            if not os.listdir(empty_dir_path):
+                paths.append(os.path.relpath(empty_dir_path, directory_to_zip))
+    return paths
+
+
+def write_package(
+    directory_to_zip,
+    output_zip_file,
+    relative_paths=None,
+    manifest=None,
+    metadata=None,
+):
+    import zipfile
+
+    if relative_paths is None:
+        relative_paths = list_package_paths(directory_to_zip)
+
+    # Build under a temporary name so a download in progress keeps reading the
+    # previous package and never sees a half-written one.
+    temporary_zip_file = f"{output_zip_file}.tmp"
+    start = time.perf_counter()
+    uncompressed_size = 0
+    with zipfile.ZipFile(temporary_zip_file, "w", zipfile.ZIP_DEFLATED) as zipf:
+        for relative_path in relative_paths:
+            full_path = os.path.join(directory_to_zip, relative_path)
+            zipf.write(full_path, arcname=relative_path)
+            if os.path.isdir(full_path):
+                logger.info(f"Added empty directory {full_path} to the zip.")
+            else:
+                uncompressed_size += os.path.getsize(full_path)
                 logger.info(f"Added file {full_path} as {relative_path} to the zip.")
 
-            for dir in dirs:
-                empty_dir_path = os.path.join(root, dir)
-                if not os.listdir(empty_dir_path):
-                    zipf.write(
-                        empty_dir_path,
-                        arcname=os.path.relpath(empty_dir_path, directory_to_zip),
-                    )
-                    logger.info(f"Added empty directory {empty_dir_path} to the zip.")
+        if manifest is not None:
+            zipf.writestr(MANIFEST_NAME, json.dumps(manifest, indent=4))
+
+    sha256 = link_manager.file_digest(temporary_zip_file)
+    os.replace(temporary_zip_file, output_zip_file)
+    save_package_metadata(
+        output_zip_file,
+        {
+            **(metadata or {}),
+            "files": len(relative_paths),
+            "uncompressed_size": uncompressed_size,
+        },
+        sha256,
+    )
+
+    compressed_size = os.path.getsize(output_zip_file)
+    metrics.PACKAGE_SECONDS.observe(time.perf_counter() - start)
+    metrics.PACKAGE_BYTES.labels("uncompressed").inc(uncompressed_size)
+    metrics.PACKAGE_BYTES.labels("compressed").inc(compressed_size)
+    if uncompressed_size:
+        metrics.PACKAGE_COMPRESSION_RATIO.set(compressed_size / uncompressed_size)
 
     logger.info(f"Packaged into {output_zip_file} successfully.")
 
 
+def metadata_path(package_file):
+    return f"{package_file}.json"
+
+
+def save_package_metadata(package_file, metadata, sha256):
+    stat = os.stat(package_file)
+    metadata = {
+        **metadata,
+        "name": os.path.basename(package_file),
+        "size": stat.st_size,
+        "mtime_ns": stat.st_mtime_ns,
+        "modified": datetime.fromtimestamp(stat.st_mtime).strftime("%Y-%m-%d %H:%M:%S"),
+        "sha256": sha256,
+    }
+    temporary_file = f"{metadata_path(package_file)}.tmp"
+    with open(temporary_file, "w") as file:
+        json.dump(metadata, file, indent=4)
+    os.replace(temporary_file, metadata_path(package_file))
+    return metadata
+
+
+def read_package_metadata(package_file, stat):
+    # The sidecar only describes the package it was written for, a zip that was
+    # replaced or touched since then is reported from its stat alone.
+    try:
+        with open(metadata_path(package_file), "r") as file:
+            metadata = json.load(file)
+        if (metadata.get("size"), metadata.get("mtime_ns")) == (
+            stat.st_size,
+            stat.st_mtime_ns,
+        ):
+            return metadata
+    except (OSError, ValueError):
+        pass
+    return {
+        "name": os.path.basename(package_file),
+        "size": stat.st_size,
+        "mtime_ns": stat.st_mtime_ns,
+        "modified": datetime.fromtimestamp(stat.st_mtime).strftime("%Y-%m-%d %H:%M:%S"),
+        "sha256": None,
+    }
+
+
+def package_metadata(package_file):
+    metadata = read_package_metadata(package_file, os.stat(package_file))
+    if metadata["sha256"] is None:
+        # Packages from before sidecars existed are hashed once and then cached.
+        metadata = save_package_metadata(
+            package_file, metadata, link_manager.file_digest(package_file)
+        )
+    return metadata
+
+
+def list_packages():
+    if not os.path.isdir(PACKAGE_DIR):
+        return []
+    packages = []
+    for entry in os.scandir(PACKAGE_DIR):
+        if entry.is_file() and fnmatch.fnmatch(entry.name, PACKAGE_PATTERN):
+            packages.append(read_package_metadata(entry.path, entry.stat()))
+    return sorted(packages, key=lambda package: package["modified"], reverse=True)
+
+
+def package_path(package_name):
+    # Only bare package names are accepted so a request cannot reach other files.
+    if not package_name or os.path.basename(package_name) != package_name:
+        return None
+    if not fnmatch.fnmatch(package_name, PACKAGE_PATTERN):
+        return None
+    path = os.path.join(PACKAGE_DIR, package_name)
+    return path if os.path.isfile(path) else None
+
+
+def list_package_entries(package_file):
+    import zipfile
+
+    with zipfile.ZipFile(package_file, "r") as zipf:
+        return [name for name in zipf.namelist() if name != MANIFEST_NAME]
+
+
 if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
     package_contents()
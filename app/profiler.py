@@ -0,0 +1,128 @@
+import cProfile
+import functools
+import io
+import json
+import logging
+import os
+import pstats
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+PROFILE_DIR = "downloads/profiles"
+TOP_FUNCTIONS = 30
+
+active = threading.local()
+
+
+def profiling_enabled(requested=False):
+    return requested or os.getenv("PROFILE_JOBS", "false").lower() == "true"
+
+
+def wrap(job_name, func, requested=False):
+    if not profiling_enabled(requested):
+        return func
+    return functools.partial(run_profiled, job_name, func)
+
+
+def run_profiled(job_name, func, *args, **kwargs):
+    session = {"job": job_name, "stages": []}
+    active.session = session
+    profile = cProfile.Profile()
+    started = datetime.now()
+    start = time.perf_counter()
+    try:
+        return profile.runcall(func, *args, **kwargs)
+    finally:
+        active.session = None
+        session["started"] = started.strftime("%Y-%m-%d %H:%M:%S")
+        session["total_seconds"] = round(time.perf_counter() - start, 4)
+        # The suffix keeps runs of the same job within one second apart.
+        save_profile(
+            profile,
+            session,
+            f"{started.strftime('%Y%m%d-%H%M%S')}-{job_name}-{uuid.uuid4().hex[:8]}",
+        )
+
+
+@contextmanager
+def stage(name):
+    session = getattr(active, "session", None)
+    if session is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        session["stages"].append(
+            {"stage": name, "seconds": round(time.perf_counter() - start, 4)}
+        )
+
+
+def retention():
+    return int(os.getenv("PROFILE_RETENTION", 50))
+
+
+def save_profile(profile, session, name):
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    profile.dump_stats(os.path.join(PROFILE_DIR, f"{name}.prof"))
+
+    summary = io.StringIO()
+    stats = pstats.Stats(profile, stream=summary)
+    stats.sort_stats("cumulative").print_stats(TOP_FUNCTIONS)
+    session["top_functions"] = summary.getvalue()
+
+    with open(os.path.join(PROFILE_DIR, f"{name}.json"), "w") as file:
+        json.dump(session, file, indent=4)
+    logger.info(f"Saved profile {name} ({session['total_seconds']}s)")
+    prune_profiles()
+
+
+def prune_profiles():
+    # Ordered by write time, the random suffix says nothing about order.
+    saved = sorted(
+        (
+            (entry.stat().st_mtime, entry.name[: -len(".json")])
+            for entry in os.scandir(PROFILE_DIR)
+            if entry.name.endswith(".json")
+        ),
+        reverse=True,
+    )
+    for mtime, name in saved[retention() :]:
+        for extension in (".prof", ".json"):
+            try:
+                os.remove(os.path.join(PROFILE_DIR, f"{name}{extension}"))
+            except FileNotFoundError:
+                pass
+
+
+def list_profiles():
+    if not os.path.isdir(PROFILE_DIR):
+        return []
+    profiles = []
+    for entry in sorted(os.scandir(PROFILE_DIR), key=lambda e: e.name, reverse=True):
+        if not entry.name.endswith(".json"):
+            continue
+        try:
+            with open(entry.path, "r") as file:
+                session = json.load(file)
+        except (OSError, ValueError) as e:
+            logger.error(f"Failed to read profile {entry.name}: {e}")
+            continue
+        name = entry.name[: -len(".json")]
+        profiles.append(
+            {
+                "name": name,
+                "job": session.get("job"),
+                "started": session.get("started"),
+                "total_seconds": session.get("total_seconds"),
+                "stages": session.get("stages", []),
+                "has_stats": os.path.exists(os.path.join(PROFILE_DIR, f"{name}.prof")),
+            }
+        )
+    return profiles
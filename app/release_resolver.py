@@ -0,0 +1,131 @@
+import logging
+import os
+import re
+
+import requests
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+REPOSITORY_PATTERN = re.compile(r"/repos/([^/]+)/([^/?#]+)/releases")
+RELEASE_FIELDS = """
+    releases(first: 1, orderBy: {field: CREATED_AT, direction: DESC}) {
+      nodes {
+        tagName
+        releaseAssets(first: %d) {
+          nodes { name updatedAt downloadUrl size }
+        }
+      }
+    }
+"""
+MAX_ASSETS = 2
+
+
+def graphql_enabled():
+    enabled = os.getenv("GITHUB_GRAPHQL", "false").lower() == "true"
+    return enabled and bool(os.getenv("GITHUB_TOKEN"))
+
+
+def graphql_url():
+    return os.getenv("GITHUB_GRAPHQL_URL", "https://api.github.com/graphql")
+
+
+def batch_size():
+    # GitHub caps a query at 500,000 nodes; 50 repositories keeps every query cheap.
+    return int(os.getenv("GITHUB_GRAPHQL_BATCH_SIZE", 50))
+
+
+def parse_repository(url):
+    match = REPOSITORY_PATTERN.search(url)
+    if not match:
+        return None
+    return match.group(1), match.group(2)
+
+
+def build_query(repositories):
+    variables = {}
+    params = []
+    fields = []
+    for index, (owner, name) in enumerate(repositories):
+        variables[f"owner{index}"] = owner
+        variables[f"name{index}"] = name
+        params.append(f"$owner{index}: String!, $name{index}: String!")
+        fields.append(
+            f"r{index}: repository(owner: $owner{index}, name: $name{index}) {{"
+            + RELEASE_FIELDS % MAX_ASSETS
+            + "}"
+        )
+    query = f"query({', '.join(params)}) {{\n" + "\n".join(fields) + "\n}"
+    return query, variables
+
+
+def to_rest_release(repository):
+    # Shape the GraphQL result like the REST /releases payload so callers can share code.
+    nodes = repository["releases"]["nodes"]
+    if not nodes:
+        return None
+    release = nodes[0]
+    return {
+        "tag_name": release["tagName"],
+        "assets": [
+            {
+                "name": asset["name"],
+                "updated_at": asset["updatedAt"],
+                "browser_download_url": asset["downloadUrl"],
+                "size": asset["size"],
+            }
+            for asset in release["releaseAssets"]["nodes"]
+        ],
+    }
+
+
+def fetch_batch(project_names, repositories):
+    query, variables = build_query(repositories)
+    headers = {"Authorization": f"bearer {os.getenv('GITHUB_TOKEN')}"}
+    with metrics.HTTP_FETCH_SECONDS.labels("graphql").time():
+        response = requests.post(
+            graphql_url(),
+            json={"query": query, "variables": variables},
+            headers=headers,
+        )
+    metrics.HTTP_FETCH_BYTES.labels("graphql").inc(len(response.content))
+    response.raise_for_status()
+    payload = response.json()
+
+    for error in payload.get("errors", []):
+        logger.warning(f"GraphQL error: {error.get('message')}")
+
+    data = payload.get("data") or {}
+    results = {}
+    for index, project_name in enumerate(project_names):
+        repository = data.get(f"r{index}")
+        if repository is not None:
+            results[project_name] = to_rest_release(repository)
+    return results
+
+
+def resolve_latest_releases(projects):
+    # Projects that are not GitHub release URLs, or whose lookup failed, are left
+    # out of the result so the caller can fall back to the REST API for them.
+    candidates = []
+    for project_name, project_details in projects.items():
+        repository = parse_repository(project_details["url"])
+        if repository:
+            candidates.append((project_name, repository))
+
+    results = {}
+    size = batch_size()
+    for start in range(0, len(candidates), size):
+        chunk = candidates[start : start + size]
+        try:
+            results.update(
+                fetch_batch(
+                    [project_name for project_name, _ in chunk],
+                    [repository for _, repository in chunk],
+                )
+            )
+        except (requests.RequestException, ValueError) as e:
+            logger.error(f"Batched release lookup failed, falling back to REST: {e}")
+    logger.info(f"Resolved {len(results)} of {len(candidates)} sources with GraphQL.")
+    return results
@@ -0,0 +1,162 @@
+import filecmp
+import logging
+import os
+import shutil
+import time
+from datetime import datetime
+
+import link_manager
+
+logger = logging.getLogger(__name__)
+
+OUTPUT_LINK = "downloads/output"
+SNAPSHOT_DIR = "downloads/snapshots"
+BUILDING_SUFFIX = ".building"
+# Another worker may still be building, so only builds left this long are removed.
+STALE_BUILD_SECONDS = 24 * 60 * 60
+
+building_snapshots = set()
+
+
+def retention():
+    return int(os.getenv("SNAPSHOT_RETENTION", 3))
+
+
+def snapshots_enabled():
+    return retention() > 0
+
+
+def snapshot_path(name):
+    return os.path.join(SNAPSHOT_DIR, name)
+
+
+def current_snapshot():
+    if not os.path.islink(OUTPUT_LINK):
+        return None
+    return os.path.basename(os.readlink(OUTPUT_LINK))
+
+
+def list_snapshots():
+    if not os.path.isdir(SNAPSHOT_DIR):
+        return []
+    active = current_snapshot()
+    snapshots = []
+    for entry in sorted(os.scandir(SNAPSHOT_DIR), key=lambda e: e.name, reverse=True):
+        if not entry.is_dir(follow_symlinks=False):
+            continue
+        # Snapshots still being built can't be listed or rolled back to.
+        if entry.name.endswith(BUILDING_SUFFIX):
+            continue
+        snapshots.append(
+            {
+                "name": entry.name,
+                "created": datetime.fromtimestamp(entry.stat().st_mtime).strftime(
+                    "%Y-%m-%d %H:%M:%S"
+                ),
+                "active": entry.name == active,
+            }
+        )
+    return snapshots
+
+
+def begin_snapshot():
+    os.makedirs(SNAPSHOT_DIR, exist_ok=True)
+    base_name = datetime.now().strftime("%Y%m%d-%H%M%S")
+    name = base_name
+    counter = 1
+    while os.path.exists(snapshot_path(name)) or os.path.exists(
+        snapshot_path(f"{name}{BUILDING_SUFFIX}")
+    ):
+        name = f"{base_name}-{counter}"
+        counter += 1
+    building = f"{name}{BUILDING_SUFFIX}"
+    os.makedirs(snapshot_path(building))
+    building_snapshots.add(building)
+    logger.info(f"Building snapshot {name}")
+    return building
+
+
+def finish_snapshot(building):
+    name = building[: -len(BUILDING_SUFFIX)]
+    os.rename(snapshot_path(building), snapshot_path(name))
+    building_snapshots.discard(building)
+    logger.info(f"Finished snapshot {name}")
+    return name
+
+
+def migrate_output_directory():
+    # Trees from before snapshots existed become the first snapshot.
+    if os.path.islink(OUTPUT_LINK) or not os.path.isdir(OUTPUT_LINK):
+        return
+    os.makedirs(SNAPSHOT_DIR, exist_ok=True)
+    name = f"{datetime.now().strftime('%Y%m%d-%H%M%S')}-migrated"
+    os.rename(OUTPUT_LINK, snapshot_path(name))
+    os.symlink(os.path.join("snapshots", name), OUTPUT_LINK)
+    logger.info(f"Moved existing output directory to snapshot {name}")
+
+
+def activate_snapshot(name):
+    if not os.path.isdir(snapshot_path(name)):
+        raise FileNotFoundError(f"Snapshot {name} does not exist")
+    migrate_output_directory()
+    # Point a new symlink at the snapshot, then rename it over the old one. The
+    # rename is atomic, so readers always see either the old or the new tree.
+    temporary = f"{OUTPUT_LINK}.switchblend-swap"
+    if os.path.lexists(temporary):
+        os.remove(temporary)
+    os.symlink(os.path.join("snapshots", name), temporary)
+    os.replace(temporary, OUTPUT_LINK)
+    logger.info(f"Activated snapshot {name}")
+
+
+def discard_snapshot(name):
+    shutil.rmtree(snapshot_path(name), ignore_errors=True)
+    building_snapshots.discard(name)
+    logger.info(f"Discarded snapshot {name}")
+
+
+def share_unchanged(name, previous_name):
+    if not previous_name or not os.path.isdir(snapshot_path(previous_name)):
+        return 0
+    root = snapshot_path(name)
+    previous_root = snapshot_path(previous_name)
+    shared = 0
+    for current, dirs, files in os.walk(root):
+        for file in files:
+            path = os.path.join(current, file)
+            previous = os.path.join(previous_root, os.path.relpath(path, root))
+            if not os.path.isfile(previous) or os.path.islink(path):
+                continue
+            if os.path.samefile(path, previous):
+                continue
+            if os.path.getsize(path) != os.path.getsize(previous):
+                continue
+            if filecmp.cmp(path, previous, shallow=False):
+                if link_manager.replace_with_link(previous, path):
+                    shared += 1
+    logger.info(f"Snapshot {name} shares {shared} unchanged files with {previous_name}")
+    return shared
+
+
+def prune_snapshots():
+    keep = retention()
+    active = current_snapshot()
+    snapshots = [snapshot["name"] for snapshot in list_snapshots()]
+    for name in snapshots[keep:]:
+        if name != active:
+            discard_snapshot(name)
+    prune_stale_builds()
+
+
+def prune_stale_builds():
+    # Left behind when a build failed or the process was killed mid-download.
+    if not os.path.isdir(SNAPSHOT_DIR):
+        return
+    cutoff = time.time() - STALE_BUILD_SECONDS
+    for entry in os.scandir(SNAPSHOT_DIR):
+        if not entry.name.endswith(BUILDING_SUFFIX):
+            continue
+        if entry.name in building_snapshots or not entry.is_dir(follow_symlinks=False):
+            continue
+        if entry.stat(follow_symlinks=False).st_mtime < cutoff:
+            discard_snapshot(entry.name)
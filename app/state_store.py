@@ -0,0 +1,471 @@
+import json
+import logging
+import os
+import sqlite3
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+SCHEMA_VERSION = 4
+SOURCES_FILE = "config/sources.json"
+TASKS_FILE = "config/tasks.json"
+DEVICES_FILE = "config/devices.json"
+PROFILES_FILE = "config/profiles.json"
+DEVICE_FIELDS = [
+    "name",
+    "model",
+    "hos_version",
+    "ams_version",
+    "ip",
+    "port",
+    "username",
+    "password",
+    "profile",
+]
+
+SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS sources (
+        name TEXT PRIMARY KEY,
+        details TEXT NOT NULL
+    )""",
+    """CREATE TABLE IF NOT EXISTS tasks (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        profile TEXT NOT NULL DEFAULT '',
+        task TEXT NOT NULL
+    )""",
+    "CREATE INDEX IF NOT EXISTS tasks_profile ON tasks (profile, id)",
+    "CREATE TABLE IF NOT EXISTS profiles (name TEXT PRIMARY KEY)",
+    """CREATE TABLE IF NOT EXISTS devices (
+        name TEXT PRIMARY KEY,
+        model TEXT,
+        hos_version TEXT,
+        ams_version TEXT,
+        ip TEXT,
+        port TEXT,
+        username TEXT,
+        password TEXT,
+        profile TEXT NOT NULL DEFAULT ''
+    )""",
+    "CREATE TABLE IF NOT EXISTS settings (key TEXT PRIMARY KEY, value TEXT)",
+    """CREATE TABLE IF NOT EXISTS runs (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        kind TEXT NOT NULL,
+        status TEXT NOT NULL,
+        message TEXT,
+        started TEXT NOT NULL,
+        duration REAL NOT NULL
+    )""",
+    "CREATE INDEX IF NOT EXISTS runs_kind ON runs (kind, id)",
+    """CREATE TABLE IF NOT EXISTS assets (
+        path TEXT PRIMARY KEY,
+        url TEXT NOT NULL,
+        updated_at TEXT,
+        size INTEGER NOT NULL,
+        mtime_ns INTEGER NOT NULL,
+        sha256 TEXT NOT NULL
+    )""",
+    """CREATE TABLE IF NOT EXISTS jobs (
+        id TEXT PRIMARY KEY,
+        kind TEXT NOT NULL,
+        status TEXT NOT NULL,
+        message TEXT NOT NULL DEFAULT '',
+        created TEXT NOT NULL,
+        started TEXT,
+        finished TEXT,
+        cancel_requested INTEGER NOT NULL DEFAULT 0,
+        owner_pid INTEGER,
+        owner_token TEXT
+    )""",
+    "CREATE INDEX IF NOT EXISTS jobs_finished ON jobs (finished)",
+]
+
+
+def database_path():
+    return os.getenv("STATE_DB", "config/state.db")
+
+
+def run_history_size():
+    return int(os.getenv("RUN_HISTORY_SIZE", 500))
+
+
+@contextmanager
+def connect():
+    path = database_path()
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    connection = sqlite3.connect(path, timeout=30)
+    connection.row_factory = sqlite3.Row
+    try:
+        if connection.execute("PRAGMA user_version").fetchone()[0] < SCHEMA_VERSION:
+            initialize(connection)
+        with connection:
+            yield connection
+    finally:
+        connection.close()
+
+
+def initialize(connection):
+    connection.execute("PRAGMA journal_mode=WAL")
+    # BEGIN IMMEDIATE serializes concurrent workers, the loser re-checks the
+    # version and finds the schema and the import already done.
+    connection.execute("BEGIN IMMEDIATE")
+    try:
+        version = connection.execute("PRAGMA user_version").fetchone()[0]
+        if version < SCHEMA_VERSION:
+            for statement in SCHEMA:
+                connection.execute(statement)
+            if version == 3:
+                # The jobs table predates job owners.
+                connection.execute("ALTER TABLE jobs ADD COLUMN owner_pid INTEGER")
+                connection.execute("ALTER TABLE jobs ADD COLUMN owner_token TEXT")
+            if version == 0:
+                import_json(connection)
+            connection.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        connection.commit()
+    except Exception:
+        connection.rollback()
+        raise
+
+
+def load_json(filename):
+    if not os.path.exists(filename):
+        return None
+    with open(filename, "r") as file:
+        return json.load(file)
+
+
+def import_json(connection):
+    sources = load_json(SOURCES_FILE)
+    if sources:
+        for name, details in sources.get("GitHub", {}).items():
+            connection.execute(
+                "INSERT OR REPLACE INTO sources (name, details) VALUES (?, ?)",
+                (name, json.dumps(details)),
+            )
+        if sources.get("last_checked"):
+            connection.execute(
+                "INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)",
+                ("last_checked", sources["last_checked"]),
+            )
+        logger.info(
+            f"Imported {len(sources.get('GitHub', {}))} sources from {SOURCES_FILE}"
+        )
+
+    tasks = load_json(TASKS_FILE)
+    if tasks:
+        import_tasks(connection, tasks.get("tasks", {}))
+        logger.info(f"Imported {len(tasks.get('tasks', {}))} tasks from {TASKS_FILE}")
+
+    devices = load_json(DEVICES_FILE)
+    if devices:
+        for device in devices.get("devices", []):
+            try:
+                insert_device(connection, device)
+            except sqlite3.IntegrityError:
+                logger.warning(f"Skipped duplicate device {device.get('name')}")
+        logger.info(
+            f"Imported {len(devices.get('devices', []))} devices from {DEVICES_FILE}"
+        )
+
+    profiles = load_json(PROFILES_FILE)
+    if profiles:
+        for name, profile in profiles.get("profiles", {}).items():
+            connection.execute(
+                "INSERT OR IGNORE INTO profiles (name) VALUES (?)", (name,)
+            )
+            import_tasks(connection, profile.get("tasks", {}), name)
+        logger.info(
+            f"Imported {len(profiles.get('profiles', {}))} build profiles from {PROFILES_FILE}"
+        )
+
+
+def import_tasks(connection, tasks, profile=""):
+    for key, task in sorted(tasks.items(), key=lambda x: int(x[0])):
+        connection.execute(
+            "INSERT INTO tasks (profile, task) VALUES (?, ?)", (profile, task)
+        )
+
+
+def load_sources(names=None):
+    with connect() as connection:
+        if names is None:
+            rows = connection.execute(
+                "SELECT name, details FROM sources ORDER BY rowid"
+            )
+        else:
+            placeholders = ", ".join("?" for name in names)
+            rows = connection.execute(
+                f"SELECT name, details FROM sources WHERE name IN ({placeholders}) ORDER BY rowid",
+                list(names),
+            )
+        return {row["name"]: json.loads(row["details"]) for row in rows}
+
+
+def get_source(name):
+    with connect() as connection:
+        row = connection.execute(
+            "SELECT details FROM sources WHERE name = ?", (name,)
+        ).fetchone()
+    return json.loads(row["details"]) if row else None
+
+
+def save_source(name, details):
+    with connect() as connection:
+        connection.execute(
+            "INSERT INTO sources (name, details) VALUES (?, ?) "
+            "ON CONFLICT (name) DO UPDATE SET details = excluded.details",
+            (name, json.dumps(details)),
+        )
+
+
+def update_sources(sources):
+    # Only rows that still exist are updated, so a source deleted while a long
+    # check or download was running is not brought back.
+    with connect() as connection:
+        connection.executemany(
+            "UPDATE sources SET details = ? WHERE name = ?",
+            [(json.dumps(details), name) for name, details in sources.items()],
+        )
+
+
+def delete_source(name):
+    with connect() as connection:
+        connection.execute("DELETE FROM sources WHERE name = ?", (name,))
+
+
+def get_setting(key, default=None):
+    with connect() as connection:
+        row = connection.execute(
+            "SELECT value FROM settings WHERE key = ?", (key,)
+        ).fetchone()
+    return row["value"] if row else default
+
+
+def set_setting(key, value):
+    with connect() as connection:
+        connection.execute(
+            "INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)", (key, value)
+        )
+
+
+def load_tasks(profile=""):
+    with connect() as connection:
+        rows = connection.execute(
+            "SELECT id, task FROM tasks WHERE profile = ? ORDER BY id", (profile,)
+        )
+        return {str(row["id"]): row["task"] for row in rows}
+
+
+def add_task(task, profile=""):
+    with connect() as connection:
+        connection.execute(
+            "INSERT INTO tasks (profile, task) VALUES (?, ?)", (profile, task)
+        )
+
+
+def delete_task(task_id):
+    with connect() as connection:
+        cursor = connection.execute("DELETE FROM tasks WHERE id = ?", (task_id,))
+    return cursor.rowcount > 0
+
+
+def load_profiles():
+    with connect() as connection:
+        profiles = {
+            row["name"]: {"tasks": {}}
+            for row in connection.execute("SELECT name FROM profiles ORDER BY name")
+        }
+        rows = connection.execute(
+            "SELECT id, profile, task FROM tasks WHERE profile != '' ORDER BY id"
+        )
+        for row in rows:
+            if row["profile"] in profiles:
+                profiles[row["profile"]]["tasks"][str(row["id"])] = row["task"]
+    return profiles
+
+
+def add_profile(name):
+    with connect() as connection:
+        connection.execute("INSERT OR IGNORE INTO profiles (name) VALUES (?)", (name,))
+
+
+def delete_profile(name):
+    with connect() as connection:
+        connection.execute("DELETE FROM tasks WHERE profile = ?", (name,))
+        cursor = connection.execute("DELETE FROM profiles WHERE name = ?", (name,))
+    return cursor.rowcount > 0
+
+
+def insert_device(connection, device):
+    connection.execute(
+        f"INSERT INTO devices ({', '.join(DEVICE_FIELDS)}) "
+        f"VALUES ({', '.join('?' for field in DEVICE_FIELDS)})",
+        [device.get(field) or "" for field in DEVICE_FIELDS],
+    )
+
+
+def load_devices():
+    with connect() as connection:
+        rows = connection.execute("SELECT * FROM devices ORDER BY rowid")
+        return [dict(row) for row in rows]
+
+
+def get_device(name):
+    with connect() as connection:
+        row = connection.execute(
+            "SELECT * FROM devices WHERE name = ?", (name,)
+        ).fetchone()
+    return dict(row) if row else None
+
+
+def add_device(device):
+    try:
+        with connect() as connection:
+            insert_device(connection, device)
+    except sqlite3.IntegrityError:
+        return False
+    return True
+
+
+def update_device(original_name, device):
+    try:
+        with connect() as connection:
+            connection.execute(
+                f"UPDATE devices SET {', '.join(f'{field} = ?' for field in DEVICE_FIELDS)} "
+                "WHERE name = ?",
+                [device.get(field) or "" for field in DEVICE_FIELDS] + [original_name],
+            )
+    except sqlite3.IntegrityError:
+        return False
+    return True
+
+
+def delete_device(name):
+    with connect() as connection:
+        connection.execute("DELETE FROM devices WHERE name = ?", (name,))
+
+
+def record_run(kind, status, message, started, duration):
+    try:
+        with connect() as connection:
+            connection.execute(
+                "INSERT INTO runs (kind, status, message, started, duration) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (
+                    kind,
+                    status,
+                    message,
+                    started.strftime("%Y-%m-%d %H:%M:%S"),
+                    round(duration, 3),
+                ),
+            )
+            # Retention is per kind so frequent checks do not push out downloads.
+            connection.execute(
+                "DELETE FROM runs WHERE kind = ? AND id <= "
+                "(SELECT id FROM runs WHERE kind = ? ORDER BY id DESC LIMIT 1 OFFSET ?)",
+                (kind, kind, run_history_size()),
+            )
+    except sqlite3.Error as e:
+        logger.error(f"Failed to record {kind} run: {e}")
+
+
+def load_runs(kind=None, limit=50):
+    with connect() as connection:
+        if kind:
+            rows = connection.execute(
+                "SELECT * FROM runs WHERE kind = ? ORDER BY id DESC LIMIT ?",
+                (kind, limit),
+            )
+        else:
+            rows = connection.execute(
+                "SELECT * FROM runs ORDER BY id DESC LIMIT ?", (limit,)
+            )
+        return [dict(row) for row in rows]
+
+
+def get_asset(path):
+    with connect() as connection:
+        row = connection.execute(
+            "SELECT * FROM assets WHERE path = ?", (path,)
+        ).fetchone()
+    return dict(row) if row else None
+
+
+def save_asset(path, url, updated_at, size, mtime_ns, sha256):
+    with connect() as connection:
+        connection.execute(
+            "INSERT OR REPLACE INTO assets (path, url, updated_at, size, mtime_ns, sha256) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (path, url, updated_at, size, mtime_ns, sha256),
+        )
+
+
+def create_job(job_id, kind, created, owner_pid, owner_token):
+    with connect() as connection:
+        connection.execute(
+            "INSERT INTO jobs (id, kind, status, created, owner_pid, owner_token) "
+            "VALUES (?, ?, 'queued', ?, ?, ?)",
+            (job_id, kind, created, owner_pid, owner_token),
+        )
+
+
+def update_job(job_id, **fields):
+    with connect() as connection:
+        connection.execute(
+            f"UPDATE jobs SET {', '.join(f'{field} = ?' for field in fields)} "
+            "WHERE id = ?",
+            list(fields.values()) + [job_id],
+        )
+
+
+def get_job(job_id):
+    with connect() as connection:
+        row = connection.execute(
+            "SELECT * FROM jobs WHERE id = ?", (job_id,)
+        ).fetchone()
+    return dict(row) if row else None
+
+
+def load_unfinished_jobs():
+    with connect() as connection:
+        rows = connection.execute(
+            "SELECT * FROM jobs WHERE status IN ('queued', 'running')"
+        )
+        return [dict(row) for row in rows]
+
+
+def interrupt_job(job_id, message, finished):
+    with connect() as connection:
+        cursor = connection.execute(
+            "UPDATE jobs SET status = 'error', message = ?, finished = ? "
+            "WHERE id = ? AND status IN ('queued', 'running')",
+            (message, finished, job_id),
+        )
+    return cursor.rowcount > 0
+
+
+def request_job_cancel(job_id):
+    with connect() as connection:
+        cursor = connection.execute(
+            "UPDATE jobs SET cancel_requested = 1 "
+            "WHERE id = ? AND status IN ('queued', 'running')",
+            (job_id,),
+        )
+    return cursor.rowcount > 0
+
+
+def job_cancel_requested(job_id):
+    with connect() as connection:
+        row = connection.execute(
+            "SELECT cancel_requested FROM jobs WHERE id = ?", (job_id,)
+        ).fetchone()
+    return bool(row and row["cancel_requested"])
+
+
+def prune_finished_jobs(keep):
+    with connect() as connection:
+        connection.execute(
+            "DELETE FROM jobs WHERE finished IS NOT NULL AND id NOT IN "
+            "(SELECT id FROM jobs WHERE finished IS NOT NULL "
+            "ORDER BY finished DESC LIMIT ?)",
+            (keep,),
+        )
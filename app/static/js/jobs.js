@@ -0,0 +1,21 @@
+function pollJob(jobId, onUpdate, interval) {
+    interval = interval || 1000;
+    fetch('/jobs/' + jobId)
+        .then(response => response.json())
+        .then(job => {
+            onUpdate(job);
+            if (job.status === 'queued' || job.status === 'running') {
+                setTimeout(function () {
+                    pollJob(jobId, onUpdate, interval);
+                }, interval);
+            }
+        })
+        .catch(error => {
+            onUpdate({ status: 'error', message: 'Lost track of job ' + jobId });
+        });
+}
+
+function cancelJob(jobId) {
+    return fetch('/jobs/' + jobId + '/cancel', { method: 'POST' })
+        .then(response => response.json());
+}
@@ -1,27 +1,49 @@
-import ftplib
+import json
 import logging
 import os
 import posixpath
 import time
+from functools import partial
+
+import metrics
+import package_manager
+import profiler
 
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 ERROR_MESSAGES = {"Errno 113": "Error: Device not found. Is it offline?"}
 
 
-def upload_to_device(ip, port, username, password, local_directory, files):
+def upload_to_device(
+    ip, port, username, password, local_directory, files, cancel_event=None
+):
+    return run_upload(
+        ip, port, username, password, cancel_event, upload_tree, local_directory, files
+    )
+
+
+def upload_from_package(
+    ip, port, username, password, package_file, files=None, cancel_event=None
+):
+    return run_upload(
+        ip, port, username, password, cancel_event, upload_package, package_file, files
+    )
+
+
+def run_upload(ip, port, username, password, cancel_event, upload, *args):
+    import ftplib
+
     try:
+        start = time.perf_counter()
         ftp = ftplib.FTP()
         ftp.connect(ip, int(port))
         ftp.login(username, password)
-        for file in files:
-            full_path = os.path.join(local_directory, file)
-            if os.path.isdir(full_path):
-                upload_directory(ftp, full_path, file)
-            else:
-                upload_file(ftp, full_path, file)
+        upload(ftp, *args, cancel_event)
         ftp.quit()
+        metrics.FTP_UPLOAD_SECONDS.observe(time.perf_counter() - start)
+        if is_cancelled(cancel_event):
+            logger.info("Upload cancelled")
+            return False, "Upload cancelled"
         return True, "Upload successful"
     except ftplib.all_errors as e:
         error_message = str(e)
@@ -36,14 +58,84 @@ def upload_to_device(ip, port, username, password, local_directory, files):
         return False, f"Unexpected error: {str(e)}"
 
 
+def is_cancelled(cancel_event):
+    return cancel_event is not None and cancel_event.is_set()
+
+
+def is_selected(name, files):
+    name = name.rstrip("/")
+    return not files or any(
+        name == file or name.startswith(f"{file}/") for file in files
+    )
+
+
+def upload_tree(ftp, local_directory, files, cancel_event=None):
+    for file in files:
+        if is_cancelled(cancel_event):
+            break
+        full_path = os.path.join(local_directory, file)
+        with profiler.stage(f"upload {file}"):
+            if os.path.isdir(full_path):
+                upload_directory(ftp, full_path, file, cancel_event)
+            else:
+                upload_file(ftp, full_path, file)
+
+
+def upload_package(ftp, package_file, files=None, cancel_event=None):
+    import zipfile
+
+    # Entries are decompressed on the fly straight into STOR, so a package can
+    # be uploaded without extracting it to disk first.
+    created = set()
+    with profiler.stage(f"upload {os.path.basename(package_file)}"):
+        with zipfile.ZipFile(package_file, "r") as package:
+            for info in package.infolist():
+                if is_cancelled(cancel_event):
+                    return
+                if info.filename == package_manager.MANIFEST_NAME:
+                    continue
+                if not is_selected(info.filename, files):
+                    continue
+                if info.is_dir():
+                    ensure_remote_parent_directories(ftp, info.filename, created)
+                else:
+                    success = upload_stream(
+                        ftp, partial(package.open, info), info.filename, created=created
+                    )
+                    if not success:
+                        logger.error(
+                            f"Failed to upload {info.filename} from {package_file}"
+                        )
+            apply_package_deletions(ftp, package, files)
+
+
+def apply_package_deletions(ftp, package, files):
+    # Profile packages only carry their changes, the manifest lists the files
+    # the profile removes from the shared output.
+    if package_manager.MANIFEST_NAME not in package.namelist():
+        return
+    manifest = json.loads(package.read(package_manager.MANIFEST_NAME))
+    for path in manifest.get("deleted", []):
+        if is_selected(path, files):
+            delete_remote_file(ftp, path)
+
+
 def upload_file(ftp, local_path, remote_path, retries=3):
+    return upload_stream(ftp, partial(open, local_path, "rb"), remote_path, retries)
+
+
+def upload_stream(ftp, open_source, remote_path, retries=3, created=None):
+    import ftplib
+
     attempt = 0
     while attempt < retries:
         try:
-            ensure_remote_parent_directories(ftp, remote_path)
+            ensure_remote_parent_directories(ftp, remote_path, created)
             delete_remote_file(ftp, remote_path)
-            with open(local_path, "rb") as f:
+            with open_source() as f:
                 ftp.storbinary(f"STOR {remote_path}", f)
+                metrics.FTP_BYTES.inc(f.tell())
+                metrics.FTP_FILES.inc()
                 logger.info(f"Uploaded {remote_path}")
                 return True
         except ftplib.error_perm as e:
@@ -62,6 +154,8 @@ def upload_file(ftp, local_path, remote_path, retries=3):
 
 
 def delete_remote_file(ftp, remote_path):
+    import ftplib
+
     try:
         ftp.delete(remote_path)
         logger.info(f"Deleted remote file {remote_path}")
@@ -73,7 +167,9 @@ def delete_remote_file(ftp, remote_path):
             raise
 
 
-def ensure_remote_parent_directories(ftp, remote_path):
+def ensure_remote_parent_directories(ftp, remote_path, created=None):
+    import ftplib
+
     directory = posixpath.dirname(remote_path)
     if not directory:
         return
@@ -83,26 +179,36 @@ def ensure_remote_parent_directories(ftp, remote_path):
         if not part:
             continue
         current_path = f"{current_path}/{part}" if current_path else part
+        if created is not None:
+            if current_path in created:
+                continue
+            created.add(current_path)
         try:
             ftp.mkd(current_path)
             logger.info(f"Created remote directory {current_path}")
         except ftplib.error_perm as e:
             if not e.args[0].startswith("550"):
-                logger.error(f"Error creating remote directory {current_path}: {str(e)}")
+                logger.error(
+                    f"Error creating remote directory {current_path}: {str(e)}"
+                )
                 raise
 
 
-def upload_directory(ftp, local_directory, remote_directory):
+def upload_directory(ftp, local_directory, remote_directory, cancel_event=None):
+    import ftplib
+
     try:
         ftp.mkd(remote_directory)
     except ftplib.error_perm as e:
         if not e.args[0].startswith("550"):
             raise
     for entry in os.listdir(local_directory):
+        if is_cancelled(cancel_event):
+            return
         local_path = os.path.join(local_directory, entry)
         remote_path = posixpath.join(remote_directory, entry)
         if os.path.isdir(local_path):
-            upload_directory(ftp, local_path, remote_path)
+            upload_directory(ftp, local_path, remote_path, cancel_event)
         else:
             success = upload_file(ftp, local_path, remote_path)
             if not success:
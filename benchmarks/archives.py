@@ -0,0 +1,41 @@
+import os
+import random
+import zipfile
+
+
+def make_payload(size, rng, compressible):
+    if compressible:
+        # Repetitive text, roughly like configs and scripts in a homebrew pack.
+        line = f"{rng.random():.16f} switchblend benchmark payload\n".encode()
+        return (line * (size // len(line) + 1))[:size]
+    return rng.randbytes(size)
+
+
+def make_archive(path, file_count, file_size, fmt="zip", compressible=False, seed=0):
+    # Builds an archive laid out like a homebrew release: a handful of top-level
+    # folders with nested files. The same seed always produces the same archive.
+    rng = random.Random(seed)
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    entries = []
+    for index in range(file_count):
+        folder = ("atmosphere/contents", "switch", "bootloader/payloads")[index % 3]
+        entries.append(
+            (
+                f"{folder}/{seed:04d}/file{index:05d}.bin",
+                make_payload(file_size, rng, compressible),
+            )
+        )
+
+    if fmt == "zip":
+        with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as archive:
+            for name, payload in entries:
+                archive.writestr(name, payload)
+    elif fmt == "7z":
+        import py7zr
+
+        with py7zr.SevenZipFile(path, "w") as archive:
+            for name, payload in entries:
+                archive.writestr(payload, name)
+    else:
+        raise ValueError(f"Unsupported archive format: {fmt}")
+    return path
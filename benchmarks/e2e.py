@@ -0,0 +1,286 @@
+import argparse
+import json
+import logging
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+APP_DIR = os.path.join(BENCH_DIR, "..", "app")
+sys.path.insert(0, APP_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+from archives import make_archive  # noqa: E402
+from fakes import FakeGitHub, FakeSwitchFTP  # noqa: E402
+
+STAGES = ["check", "download", "extract", "cleanup", "package", "upload"]
+
+TASKS = [
+    "copy bootloader bootloader_copy",
+    "rename atmosphere/contents/0000 atmosphere/contents/renamed",
+    "move switch/0000 switch/moved",
+    "delete switch/0001",
+]
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            cwd=BENCH_DIR,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def directory_size(path):
+    total = 0
+    for root, dirs, files in os.walk(path):
+        for file in files:
+            total += os.path.getsize(os.path.join(root, file))
+    return total
+
+
+def write_json(data, filename):
+    with open(filename, "w") as file:
+        json.dump(data, file, indent=4)
+
+
+class Environment:
+    def __init__(self, args):
+        self.args = args
+        self.workdir = tempfile.mkdtemp(prefix="switchblend-bench-")
+        # Inside config/, so reset() also drops the database and every cycle
+        # imports the fake sources afresh instead of touching an exported STATE_DB.
+        os.environ["STATE_DB"] = os.path.join(self.workdir, "config", "state.db")
+        self.github = FakeGitHub(latency=args.http_latency).start()
+        self.ftp = FakeSwitchFTP(
+            os.path.join(self.workdir, "switch-sd"),
+            latency=args.ftp_latency,
+            bandwidth=args.ftp_bandwidth,
+        ).start()
+
+        asset_dir = os.path.join(self.workdir, "assets")
+        self.archive_bytes = 0
+        for index in range(args.sources):
+            fmt = "7z" if index < args.sources_7z else "zip"
+            path = make_archive(
+                os.path.join(asset_dir, f"project{index}.{fmt}"),
+                args.files,
+                args.file_size,
+                fmt=fmt,
+                compressible=args.compressible,
+                seed=index,
+            )
+            self.archive_bytes += os.path.getsize(path)
+            self.github.add_release(
+                "bench",
+                f"project{index}",
+                path,
+                f"2026-01-{index % 28 + 1:02d}T00:00:00Z",
+            )
+
+        os.chdir(self.workdir)
+
+    def reset(self):
+        # Every cycle starts from a clean tree and a cold release cache.
+        for path in ("downloads", "config", "switch-sd"):
+            shutil.rmtree(path, ignore_errors=True)
+        os.makedirs("config")
+        os.makedirs("switch-sd")
+        sources = {
+            f"project{index}": {
+                "url": self.github.releases_url("bench", f"project{index}"),
+                "name": f"project{index}",
+                "updated": True,
+            }
+            for index in range(self.args.sources)
+        }
+        write_json(
+            {"GitHub": sources, "last_checked": "Never checked"}, "config/sources.json"
+        )
+        write_json(
+            {"tasks": {str(i + 1): task for i, task in enumerate(TASKS)}},
+            "config/tasks.json",
+        )
+        write_json({"devices": []}, "config/devices.json")
+
+    def close(self):
+        os.chdir(BENCH_DIR)
+        self.github.stop()
+        self.ftp.stop()
+        shutil.rmtree(self.workdir, ignore_errors=True)
+
+
+def run_download():
+    import download_manager
+    import profiler
+
+    # Collect the extract stages download_manager already records, so archive
+    # extraction is reported apart from fetching.
+    session = {"stages": []}
+    profiler.active.session = session
+    start = time.perf_counter()
+    try:
+        download_manager.main(force_download=True)
+    finally:
+        profiler.active.session = None
+    elapsed = time.perf_counter() - start
+    extract = sum(
+        entry["seconds"]
+        for entry in session["stages"]
+        if entry["stage"].startswith("extract ")
+    )
+    return {"download": elapsed - extract, "extract": extract}
+
+
+def run_stage(stage, env):
+    import cleanup_manager
+    import download_manager
+    import package_manager
+    import upload_manager
+
+    start = time.perf_counter()
+    if stage == "check":
+        download_manager.check_and_update_sources()
+    elif stage == "download":
+        return run_download()
+    elif stage == "cleanup":
+        cleanup_manager.delete_files()
+    elif stage == "package":
+        package_manager.package_contents()
+    elif stage == "upload":
+        success, message = upload_manager.upload_to_device(
+            "127.0.0.1",
+            env.ftp.port,
+            env.ftp.username,
+            env.ftp.password,
+            "downloads/output",
+            sorted(os.listdir("downloads/output")),
+        )
+        if not success:
+            raise RuntimeError(f"Upload failed: {message}")
+    return {stage: time.perf_counter() - start}
+
+
+def run_cycle(env, timed_stages):
+    env.reset()
+    timings = {}
+    for stage in STAGES:
+        # Extraction runs inside the download stage, which times it separately.
+        if stage != "extract":
+            for name, seconds in run_stage(stage, env).items():
+                if name in timed_stages:
+                    timings[name] = seconds
+        if stage == timed_stages[-1]:
+            break
+    timings["total"] = sum(timings.values())
+    return timings
+
+
+def summarize(runs):
+    summary = {}
+    for key in runs[0]:
+        values = [run[key] for run in runs]
+        summary[key] = {
+            "median": round(statistics.median(values), 4),
+            "min": round(min(values), 4),
+            "max": round(max(values), 4),
+        }
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Time the check, download, extract, cleanup, package and upload cycle against local fakes."
+    )
+    parser.add_argument("--stages", nargs="+", choices=STAGES, default=STAGES)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--sources", type=int, default=5)
+    parser.add_argument(
+        "--sources-7z", type=int, default=1, help="How many sources ship a 7z"
+    )
+    parser.add_argument("--files", type=int, default=200, help="Files per archive")
+    parser.add_argument("--file-size", type=int, default=64 * 1024)
+    parser.add_argument("--compressible", action="store_true")
+    parser.add_argument("--http-latency", type=float, default=0.0)
+    parser.add_argument("--ftp-latency", type=float, default=0.0)
+    parser.add_argument(
+        "--ftp-bandwidth", type=int, default=0, help="Bytes per second, 0 for unlimited"
+    )
+    parser.add_argument(
+        "--graphql",
+        action="store_true",
+        help="Resolve releases through the fake GraphQL endpoint",
+    )
+    parser.add_argument("--label")
+    parser.add_argument(
+        "--output", help="Defaults to benchmarks/results/e2e-<timestamp>.json"
+    )
+    args = parser.parse_args()
+    # The cycle runs in a temporary directory, resolve against the caller's cwd.
+    if args.output:
+        args.output = os.path.abspath(args.output)
+
+    logging.basicConfig(level=logging.WARNING)
+    timed_stages = [stage for stage in STAGES if stage in args.stages]
+
+    env = Environment(args)
+    if args.graphql:
+        os.environ["GITHUB_GRAPHQL"] = "true"
+        os.environ.setdefault("GITHUB_TOKEN", "benchmark")
+        os.environ["GITHUB_GRAPHQL_URL"] = f"{env.github.base_url}/graphql"
+
+    try:
+        runs = [run_cycle(env, timed_stages) for _ in range(args.repeat)]
+        sizes = {
+            "archive_bytes": env.archive_bytes,
+            "output_bytes": directory_size("downloads/output"),
+            "package_bytes": (
+                sum(
+                    os.path.getsize(os.path.join("downloads", name))
+                    for name in os.listdir("downloads")
+                    if name.endswith(".zip")
+                )
+                if os.path.isdir("downloads")
+                else 0
+            ),
+        }
+    finally:
+        env.close()
+
+    result = {
+        "suite": "e2e",
+        "label": args.label,
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "git_commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "parameters": {
+            key: value for key, value in vars(args).items() if key != "output"
+        },
+        "sizes": sizes,
+        "summary": summarize(runs),
+        "runs": runs,
+    }
+
+    output = args.output or os.path.join(
+        BENCH_DIR, "results", f"e2e-{datetime.now().strftime('%Y%m%d-%H%M%S')}.json"
+    )
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    write_json(result, output)
+    print(json.dumps(result["summary"], indent=4))
+    print(f"Results written to {output}")
+
+
+if __name__ == "__main__":
+    main()
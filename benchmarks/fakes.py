@@ -0,0 +1,234 @@
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+RELEASES_PATH = re.compile(r"^/repos/([^/]+)/([^/]+)/releases")
+RANGE_HEADER = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for block in iter(lambda: file.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class FakeGitHub:
+    # Serves a GitHub-like releases API, a GraphQL endpoint and the release
+    # assets themselves (with Range support) from one local HTTP server.
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.releases = {}
+        self.assets = {}
+        self.requests = 0
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), self.handler_class())
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self.server.server_port}"
+
+    def releases_url(self, owner, repo):
+        return f"{self.base_url}/repos/{owner}/{repo}/releases?per_page=1"
+
+    def add_release(self, owner, repo, asset_path, updated_at):
+        name = os.path.basename(asset_path)
+        self.assets[f"/assets/{owner}/{repo}/{name}"] = asset_path
+        self.releases[(owner, repo)] = [
+            {
+                "tag_name": updated_at,
+                "assets": [
+                    {
+                        "name": name,
+                        "updated_at": updated_at,
+                        "size": os.path.getsize(asset_path),
+                        "digest": f"sha256:{file_sha256(asset_path)}",
+                        "browser_download_url": f"{self.base_url}/assets/{owner}/{repo}/{name}",
+                    }
+                ],
+            }
+        ]
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def handler_class(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                pass
+
+            def do_GET(self):
+                fake.requests += 1
+                time.sleep(fake.latency)
+                match = RELEASES_PATH.match(self.path)
+                if match:
+                    return self.send_releases(match.group(1), match.group(2))
+                if self.path in fake.assets:
+                    return self.send_asset(fake.assets[self.path])
+                self.send_json({"message": "Not Found"}, 404)
+
+            def do_POST(self):
+                fake.requests += 1
+                time.sleep(fake.latency)
+                if self.path != "/graphql":
+                    return self.send_json({"message": "Not Found"}, 404)
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                variables = json.loads(body).get("variables", {})
+                data = {}
+                for index in range(len(variables) // 2):
+                    key = (variables[f"owner{index}"], variables[f"name{index}"])
+                    data[f"r{index}"] = graphql_repository(fake.releases.get(key))
+                self.send_json({"data": data})
+
+            def send_releases(self, owner, repo):
+                releases = fake.releases.get((owner, repo))
+                if releases is None:
+                    return self.send_json({"message": "Not Found"}, 404)
+                body = json.dumps(releases).encode()
+                etag = f'"{hashlib.sha1(body).hexdigest()}"'
+                if self.headers.get("If-None-Match") == etag:
+                    self.send_response(304)
+                    self.send_header("ETag", etag)
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+                self.send_json(releases, etag=etag)
+
+            def send_json(self, payload, status=200, etag=None):
+                body = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.send_header("X-RateLimit-Remaining", "5000")
+                self.send_header("X-RateLimit-Reset", str(int(time.time()) + 3600))
+                if etag:
+                    self.send_header("ETag", etag)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def send_asset(self, path):
+                size = os.path.getsize(path)
+                start, end = 0, size - 1
+                status = 200
+                match = RANGE_HEADER.match(self.headers.get("Range", ""))
+                if match and (match.group(1) or match.group(2)):
+                    if match.group(1):
+                        start = int(match.group(1))
+                        end = int(match.group(2)) if match.group(2) else size - 1
+                    else:
+                        start = max(0, size - int(match.group(2)))
+                    end = min(end, size - 1)
+                    if start > end:
+                        self.send_response(416)
+                        self.send_header("Content-Range", f"bytes */{size}")
+                        self.send_header("Content-Length", "0")
+                        self.end_headers()
+                        return
+                    status = 206
+
+                self.send_response(status)
+                self.send_header("Content-Type", "application/octet-stream")
+                self.send_header("Accept-Ranges", "bytes")
+                self.send_header("Content-Length", str(end - start + 1))
+                if status == 206:
+                    self.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+                self.end_headers()
+                with open(path, "rb") as file:
+                    file.seek(start)
+                    remaining = end - start + 1
+                    while remaining:
+                        chunk = file.read(min(65536, remaining))
+                        if not chunk:
+                            break
+                        self.wfile.write(chunk)
+                        remaining -= len(chunk)
+
+        return Handler
+
+
+def graphql_repository(releases):
+    if releases is None:
+        return None
+    return {
+        "releases": {
+            "nodes": [
+                {
+                    "tagName": release["tag_name"],
+                    "releaseAssets": {
+                        "nodes": [
+                            {
+                                "name": asset["name"],
+                                "updatedAt": asset["updated_at"],
+                                "downloadUrl": asset["browser_download_url"],
+                                "size": asset["size"],
+                            }
+                            for asset in release["assets"]
+                        ]
+                    },
+                }
+                for release in releases[:1]
+            ]
+        }
+    }
+
+
+class FakeSwitchFTP:
+    # A local FTP server standing in for a Switch running an FTP homebrew.
+    # `latency` is added to every command to mimic the round trip over Wi-Fi,
+    # and `bandwidth` (bytes per second) throttles the data connection.
+
+    def __init__(
+        self, root, latency=0.0, bandwidth=0, username="switch", password="switch"
+    ):
+        from pyftpdlib.authorizers import DummyAuthorizer
+        from pyftpdlib.handlers import FTPHandler, ThrottledDTPHandler
+        from pyftpdlib.servers import ThreadedFTPServer
+
+        os.makedirs(root, exist_ok=True)
+        self.root = root
+        self.username = username
+        self.password = password
+
+        authorizer = DummyAuthorizer()
+        authorizer.add_user(username, password, root, perm="elradfmwMT")
+
+        class LatencyHandler(FTPHandler):
+            def process_command(self, cmd, *args, **kwargs):
+                if latency:
+                    time.sleep(latency)
+                return super().process_command(cmd, *args, **kwargs)
+
+        LatencyHandler.authorizer = authorizer
+        if bandwidth:
+            dtp_handler = type("BenchDTPHandler", (ThrottledDTPHandler,), {})
+            dtp_handler.read_limit = bandwidth
+            LatencyHandler.dtp_handler = dtp_handler
+
+        self.server = ThreadedFTPServer(("127.0.0.1", 0), LatencyHandler)
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def port(self):
+        return self.server.address[1]
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.close_all()
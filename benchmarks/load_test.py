@@ -0,0 +1,80 @@
+import argparse
+import json
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+
+def fetch(session, url):
+    start = time.perf_counter()
+    try:
+        response = session.get(url, timeout=30)
+        ok = response.status_code < 500
+    except requests.RequestException:
+        ok = False
+    return ok, time.perf_counter() - start
+
+
+def run(url, concurrency, total):
+    sessions = [requests.Session() for _ in range(concurrency)]
+    latencies = []
+    errors = 0
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        futures = [
+            pool.submit(fetch, sessions[i % concurrency], url) for i in range(total)
+        ]
+        for future in futures:
+            ok, latency = future.result()
+            latencies.append(latency)
+            if not ok:
+                errors += 1
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    return {
+        "url": url,
+        "concurrency": concurrency,
+        "requests": total,
+        "errors": errors,
+        "elapsed_seconds": round(elapsed, 3),
+        "requests_per_second": round(total / elapsed, 2),
+        "latency_ms": {
+            "mean": round(statistics.mean(latencies) * 1000, 2),
+            "p50": round(latencies[len(latencies) // 2] * 1000, 2),
+            "p95": round(latencies[int(len(latencies) * 0.95) - 1] * 1000, 2),
+            "max": round(latencies[-1] * 1000, 2),
+        },
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Measure concurrent request throughput against a running switchblend instance."
+    )
+    parser.add_argument("--url", default="http://localhost:5000/")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument(
+        "--label", help="Tag stored with the results, e.g. 'dev' or 'gunicorn'"
+    )
+    parser.add_argument(
+        "--output", help="Append the result as a JSON line to this file"
+    )
+    args = parser.parse_args()
+
+    result = run(args.url, args.concurrency, args.requests)
+    if args.label:
+        result["label"] = args.label
+    print(json.dumps(result, indent=4))
+
+    if args.output:
+        with open(args.output, "a") as file:
+            file.write(json.dumps(result) + "\n")
+
+
+if __name__ == "__main__":
+    main()
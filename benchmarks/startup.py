@@ -0,0 +1,82 @@
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+APP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app")
+
+PROBE = """
+import json
+import sys
+import time
+
+start = time.perf_counter()
+import app
+imported = time.perf_counter()
+flask_app = app.create_app()
+created = time.perf_counter()
+response = flask_app.test_client().get("/")
+served = time.perf_counter()
+
+print(json.dumps({
+    "import_seconds": imported - start,
+    "create_app_seconds": created - imported,
+    "first_request_seconds": served - created,
+    "time_to_first_request_seconds": served - start,
+    "status_code": response.status_code,
+    "modules_loaded": len(sys.modules),
+    "heavy_modules_loaded": sorted(
+        name for name in ("py7zr", "zipfile", "ftplib", "apscheduler") if name in sys.modules
+    ),
+}))
+"""
+
+
+def probe():
+    # A throwaway database keeps the first request from creating app/config/state.db
+    # and importing the live JSON config into it.
+    with tempfile.TemporaryDirectory(prefix="switchblend-startup-") as state_dir:
+        env = dict(os.environ, STATE_DB=os.path.join(state_dir, "state.db"))
+        result = subprocess.run(
+            [sys.executable, "-c", PROBE],
+            cwd=APP_DIR,
+            env=env,
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Measure import time and time-to-first-request of the app in fresh interpreters."
+    )
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--output", help="Write the results as JSON to this file")
+    args = parser.parse_args()
+
+    runs = [probe() for _ in range(args.runs)]
+    summary = {"runs": args.runs}
+    for key in (
+        "import_seconds",
+        "create_app_seconds",
+        "first_request_seconds",
+        "time_to_first_request_seconds",
+    ):
+        summary[key] = round(statistics.median(run[key] for run in runs), 4)
+    summary["status_code"] = runs[-1]["status_code"]
+    summary["modules_loaded"] = runs[-1]["modules_loaded"]
+    summary["heavy_modules_loaded"] = runs[-1]["heavy_modules_loaded"]
+
+    print(json.dumps(summary, indent=4))
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump({"summary": summary, "runs": runs}, file, indent=4)
+
+
+if __name__ == "__main__":
+    main()
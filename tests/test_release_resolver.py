@@ -0,0 +1,73 @@
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "app"))
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+
+import release_resolver  # noqa: E402
+from fakes import FakeGitHub  # noqa: E402
+
+
+@pytest.fixture
+def github(tmp_path, monkeypatch):
+    fake = FakeGitHub()
+    fake.start()
+    asset = tmp_path / "pack.zip"
+    asset.write_bytes(b"archive")
+    for index in range(3):
+        fake.add_release(
+            "owner", f"repo{index}", str(asset), f"2026-01-0{index + 1}T00:00:00Z"
+        )
+    monkeypatch.setenv("GITHUB_TOKEN", "token")
+    monkeypatch.setenv("GITHUB_GRAPHQL", "true")
+    monkeypatch.setenv("GITHUB_GRAPHQL_URL", f"{fake.base_url}/graphql")
+    yield fake
+    fake.stop()
+
+
+def projects_for(fake, count=3):
+    return {
+        f"repo{index}": {"url": fake.releases_url("owner", f"repo{index}")}
+        for index in range(count)
+    }
+
+
+def test_maps_graphql_result_to_rest_fields(github):
+    results = release_resolver.resolve_latest_releases(projects_for(github, 1))
+
+    release = results["repo0"]
+    rest_release = github.releases[("owner", "repo0")][0]
+    assert release["tag_name"] == rest_release["tag_name"]
+    asset = release["assets"][0]
+    rest_asset = rest_release["assets"][0]
+    for field in ("name", "updated_at", "browser_download_url", "size"):
+        assert asset[field] == rest_asset[field]
+
+
+def test_splits_repositories_into_batches(github, monkeypatch):
+    monkeypatch.setenv("GITHUB_GRAPHQL_BATCH_SIZE", "1")
+
+    results = release_resolver.resolve_latest_releases(projects_for(github))
+
+    assert sorted(results) == ["repo0", "repo1", "repo2"]
+    assert github.requests == 3
+
+
+def test_leaves_unresolved_and_non_github_sources_for_rest(github):
+    projects = projects_for(github, 1)
+    projects["missing"] = {"url": github.releases_url("owner", "missing")}
+    projects["direct"] = {"url": "https://example.com/pack.zip"}
+
+    results = release_resolver.resolve_latest_releases(projects)
+
+    assert sorted(results) == ["repo0"]
+    assert github.requests == 1
+
+
+def test_failed_query_falls_back_to_rest(github, monkeypatch):
+    monkeypatch.setenv("GITHUB_GRAPHQL_URL", f"{github.base_url}/not-graphql")
+
+    assert release_resolver.resolve_latest_releases(projects_for(github)) == {}